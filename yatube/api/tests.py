@@ -0,0 +1,131 @@
+from datetime import timedelta
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import archive
+from posts.models import ArchivedPost, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Тестовый пост', group=cls.group)
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Комментарий')
+        Follow.objects.create(user=cls.reader, author=cls.user)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+        cache.clear()
+
+    def test_feeds_return_posts(self):
+        """все ленты отдают пост в JSON"""
+        urls = [
+            (self.guest_client, reverse('api:index')),
+            (self.guest_client, reverse(
+                'api:group_posts', kwargs={'slug': 'group'})),
+            (self.guest_client, reverse(
+                'api:profile', kwargs={'username': 'auth'})),
+            (self.authorized_client, reverse('api:follow_index')),
+        ]
+        for client, url in urls:
+            with self.subTest(url=url):
+                data = client.get(url).json()
+                self.assertEqual(data['results'][0]['id'], self.post.pk)
+                self.assertEqual(data['results'][0]['group'], 'group')
+                self.assertIsNone(data['next'])
+
+    def test_post_detail_with_comments(self):
+        """пост отдаётся вместе с комментариями"""
+        data = self.guest_client.get(reverse(
+            'api:post_detail', kwargs={'post_id': self.post.pk})).json()
+        self.assertEqual(data['text'], 'Тестовый пост')
+        self.assertEqual(data['comments']['results'][0]['author'], 'reader')
+
+    def test_follow_requires_login(self):
+        response = self.guest_client.get(reverse('api:follow_index'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_conditional_get(self):
+        """неизменённая лента отдаёт 304, изменённая -- новые данные"""
+        url = reverse('api:index')
+        response = self.guest_client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        not_modified = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        Post.objects.create(author=self.user, text='Ещё пост')
+        modified = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(modified.status_code, HTTPStatus.OK)
+        self.assertEqual(len(modified.json()['results']), 2)
+
+    def test_new_comment_changes_post_etag(self):
+        """новый комментарий меняет ETag поста"""
+        url = reverse('api:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.guest_client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Ответ')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_new_comment_changes_follow_etag(self):
+        """новый комментарий меняет ETag ленты подписок"""
+        url = reverse('api:follow_index')
+        etag = self.authorized_client.get(url)['ETag']
+        not_modified = self.authorized_client.get(
+            url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Ответ')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['results'][0]['comments_count'], 2)
+
+
+class ApiArchiveTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(author=cls.user, text='Старый')
+        Comment.objects.create(
+            post=cls.old_post, author=reader, text='Старый комментарий')
+        Post.objects.filter(pk=cls.old_post.pk).update(
+            pub_date=timezone.now() - timedelta(days=400))
+        cls.new_post = Post.objects.create(author=cls.user, text='Новый')
+        archive.archive_batch(archive.cutoff())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_archived_post_in_api(self):
+        """архивный пост виден в профиле и по адресу поста, как в HTML"""
+        self.assertTrue(
+            ArchivedPost.objects.filter(pk=self.old_post.pk).exists())
+        response = self.client.get(
+            reverse('api:profile', kwargs={'username': 'auth'}))
+        self.assertEqual(
+            [post['id'] for post in response.json()['results']],
+            [self.new_post.pk, self.old_post.pk])
+        response = self.client.get(
+            reverse('api:post_detail', kwargs={'post_id': self.old_post.pk}))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = response.json()
+        self.assertEqual(data['text'], 'Старый')
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']['results']],
+            ['Старый комментарий'])
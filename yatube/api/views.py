@@ -0,0 +1,103 @@
+from http import HTTPStatus
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_GET
+
+from core.db_router import primary
+from posts import cache, timeline
+from posts.conditional import (feed_etag, feed_last_modified, make_etag,
+                               post_last_modified, timeline_state)
+from posts.models import Group, Post, User
+from posts.utils import COUNT_COMMENTS, COUNT_POSTS, CursorPaginator
+
+from .serializers import serialize_comment, serialize_page, serialize_post
+
+
+def json_response(data, status=HTTPStatus.OK):
+    return JsonResponse(data, status=status, json_dumps_params={
+        'ensure_ascii': False,
+        'separators': (',', ':'),
+    })
+
+
+def posts_page(request, queryset, field='pub_date'):
+    page_obj = CursorPaginator(
+        queryset, COUNT_POSTS, field=field).get_page(request.GET)
+    return json_response(serialize_page(page_obj, serialize_post))
+
+
+@require_GET
+@primary()
+@condition(
+    etag_func=lambda request: feed_etag(request, cache.index_feed()),
+    last_modified_func=lambda request: feed_last_modified(
+        cache.index_feed(), Post.objects.all()),
+)
+def index(request):
+    return posts_page(request, Post.objects.feed())
+
+
+@require_GET
+@primary()
+@condition(
+    etag_func=lambda request, slug: feed_etag(
+        request, cache.group_feed(slug)),
+    last_modified_func=lambda request, slug: feed_last_modified(
+        cache.group_feed(slug), Post.objects.filter(group__slug=slug)),
+)
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return posts_page(request, group.posts.feed())
+
+
+@require_GET
+@primary()
+@condition(
+    etag_func=lambda request, username: feed_etag(
+        request, cache.profile_feed(username)),
+    last_modified_func=lambda request, username: feed_last_modified(
+        cache.profile_feed(username),
+        Post.objects.filter(author__username=username)),
+)
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return posts_page(
+        request, Post.with_archive.filter(author=author).feed())
+
+
+@require_GET
+@primary()
+@condition(
+    etag_func=lambda request, post_id: feed_etag(
+        request, cache.post_feed(post_id)),
+    last_modified_func=lambda request, post_id: post_last_modified(post_id),
+)
+def post_detail(request, post_id):
+    post = get_object_or_404(Post.with_archive.feed(), pk=post_id)
+    comments = CursorPaginator(
+        post.comments.select_related('author'), COUNT_COMMENTS,
+        field='created', descending=False,
+    ).get_page(request.GET)
+    data = serialize_post(post)
+    data['comments'] = serialize_page(comments, serialize_comment)
+    return json_response(data)
+
+
+def follow_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    posts = timeline.timeline_posts(request.user)
+    return make_etag(request.user.pk, request.get_full_path(),
+                     timeline_state(request, posts))
+
+
+@require_GET
+@primary()
+@condition(etag_func=follow_etag)
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return json_response({'detail': 'Требуется авторизация.'},
+                             status=HTTPStatus.UNAUTHORIZED)
+    posts = timeline.timeline_posts(request.user).feed()
+    return posts_page(request, posts, field=timeline.ORDER_FIELD)
@@ -0,0 +1,299 @@
+"""Кэш в файле SQLite (режим WAL), общий для всех процессов на машине.
+
+В отличие от LocMemCache все воркеры WSGI-сервера видят одни и те же
+записи, поэтому страница считается один раз, а сброс версий лент
+доходит до всех. Запись вытесняется по давности последнего чтения
+(LRU), объём ограничивают MAX_ENTRIES и MAX_SIZE (байт). Целые числа
+хранятся как INTEGER, поэтому incr -- один атомарный UPDATE.
+
+Значения -- pickle, и в кэше лежат сессии, поэтому каталог создаётся
+с правами 0700, файл -- 0600, а чужой или открытый всем файл кэш
+не откроет. Нужен SQLite 3.35+ (upsert и RETURNING).
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backend.SQLiteCache',
+            'LOCATION': '/var/lib/yatube/cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'MAX_SIZE': 256 * 2 ** 20},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+# ON CONFLICT DO UPDATE -- 3.24, RETURNING -- 3.35
+MIN_SQLITE_VERSION = (3, 35)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB, expires REAL,'
+    ' accessed INTEGER NOT NULL, size INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    # число записей и их объём без COUNT(*) по всей таблице
+    'CREATE TABLE IF NOT EXISTS stats ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+    ' entries INTEGER NOT NULL, bytes INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO stats VALUES (1, 0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN'
+    ' UPDATE stats SET entries = entries + 1, bytes = bytes + new.size;'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN'
+    ' UPDATE stats SET entries = entries - 1, bytes = bytes - old.size;'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache'
+    ' BEGIN UPDATE stats SET bytes = bytes - old.size + new.size; END',
+)
+LIVE = '(expires IS NULL OR expires > ?)'
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise ImproperlyConfigured(
+                'SQLiteCache требует SQLite {}.{} или новее, '
+                'установлен {}'.format(*MIN_SQLITE_VERSION,
+                                       sqlite3.sqlite_version))
+        super().__init__(params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 64 * 2 ** 20))
+        self._local = threading.local()
+
+    # соединение своё у каждого потока и у каждого процесса после fork
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        self._create_file()
+        connection = sqlite3.connect(
+            self.location, timeout=30, isolation_level=None,
+            check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql in SCHEMA:
+                connection.execute(sql)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _create_file(self):
+        """Создаёт файл 0600 и проверяет, что он не подложен другим."""
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        descriptor = os.open(
+            self.location, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            stat = os.fstat(descriptor)
+        finally:
+            os.close(descriptor)
+        if stat.st_uid != os.getuid():
+            raise ImproperlyConfigured(
+                'Файл кэша {} принадлежит другому пользователю'.format(
+                    self.location))
+        if stat.st_mode & 0o077:
+            os.chmod(self.location, 0o600)
+
+    def _write(self):
+        """Транзакция записи: BEGIN IMMEDIATE сразу берёт блокировку."""
+        return _Transaction(self._connection())
+
+    def _encode(self, value):
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value
+        return sqlite3.Binary(pickle.dumps(value, self.pickle_protocol))
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + (8 if isinstance(value, int) else len(value))
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT value, accessed FROM cache WHERE key = ? AND ' + LIVE,
+            (key, now)).fetchone()
+        if row is None:
+            return default
+        if row[1] < int(now):
+            # точность LRU -- секунда, чтобы не писать на каждое чтение
+            connection.execute(
+                'UPDATE cache SET accessed = ? WHERE key = ?',
+                (int(now), key))
+        return self._decode(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        now = time.time()
+        rows = self._connection().execute(
+            'SELECT key, value FROM cache WHERE key IN ({}) AND {}'.format(
+                ','.join('?' * len(keys)), LIVE),
+            (*keys, now)).fetchall()
+        return {keys[key]: self._decode(value) for key, value in rows}
+
+    def _store(self, connection, key, value, timeout, now):
+        value = self._encode(value)
+        connection.execute(
+            'INSERT INTO cache VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) '
+            'DO UPDATE SET value = excluded.value, expires = excluded.expires,'
+            ' accessed = excluded.accessed, size = excluded.size',
+            (key, value, self.get_backend_timeout(timeout), int(now),
+             self._size(key, value)))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            self._store(connection, key, value, timeout, now)
+            self._cull(connection, now)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        with self._write() as connection:
+            for key, value in data.items():
+                self._store(connection, self._key(key, version), value,
+                            timeout, now)
+            self._cull(connection, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            exists = connection.execute(
+                'SELECT 1 FROM cache WHERE key = ? AND ' + LIVE,
+                (key, now)).fetchone()
+            if exists:
+                return False
+            self._store(connection, key, value, timeout, now)
+            self._cull(connection, now)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ?, accessed = ? '
+                'WHERE key = ? AND ' + LIVE,
+                (self.get_backend_timeout(timeout), int(now), key, now))
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        rows = self._connection().execute(
+            'UPDATE cache SET value = value + ? WHERE key = ? AND '
+            "typeof(value) = 'integer' AND " + LIVE + ' RETURNING value',
+            (delta, key, time.time())).fetchall()
+        # fetchall: с RETURNING изменение фиксируется, только когда
+        # оператор выполнен до конца
+        if not rows:
+            raise ValueError("Key '%s' not found" % key)
+        return rows[0][0]
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND ' + LIVE,
+            (key, time.time())).fetchone() is not None
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        with self._write() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if not keys:
+            return
+        with self._write() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN ({})'.format(
+                    ','.join('?' * len(keys))), keys)
+
+    def clear(self):
+        with self._write() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # соединение живёт весь срок потока: открывать файл на каждый
+        # запрос дороже, чем держать его
+        pass
+
+    def _cull(self, connection, now):
+        entries, size = connection.execute(
+            'SELECT entries, bytes FROM stats').fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (now,))
+        entries, size = connection.execute(
+            'SELECT entries, bytes FROM stats').fetchone()
+        while entries > self._max_entries or size > self._max_size:
+            # как и встроенные бэкенды, удаляем 1/CULL_FREQUENCY записей,
+            # но самые давно читанные
+            count = entries
+            if self._cull_frequency:
+                count = max(entries // self._cull_frequency, 1)
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY accessed LIMIT ?)', (count,))
+            entries, size = connection.execute(
+                'SELECT entries, bytes FROM stats').fetchone()
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def temporary_caches(directory):
+    """Копия CACHES, в которой файлы SQLiteCache лежат в directory.
+
+    Для тестов и замеров: иначе они читали бы и портили кэш сайта.
+    """
+    caches = {}
+    for alias, params in settings.CACHES.items():
+        params = dict(params)
+        if params['BACKEND'] == 'core.cache_backend.SQLiteCache':
+            params['LOCATION'] = os.path.join(
+                directory, '{}.sqlite3'.format(alias))
+        caches[alias] = params
+    return caches
@@ -0,0 +1,108 @@
+"""Чтение с реплик, запись и чтение своих записей -- с основной базы.
+
+Реплики перечислены в DATABASE_REPLICAS. ReplicaRouter отправляет
+чтения на случайную реплику, а запись -- в default. Как только запрос
+что-то записал, остальные его чтения идут в default, а
+ReplicaMiddleware запоминает в кэше время записи пользователя: все его
+запросы, с любого устройства, REPLICA_STICKY_SECONDS секунд тоже читают
+из default -- реплика может отставать, а автор должен сразу увидеть свой
+пост. У анонимов, которых не по чему узнать, то же делает cookie.
+
+Ответы, которые кэшируются или подтверждаются валидаторами (ETag,
+Last-Modified), строятся внутри primary(): иначе отставшая реплика
+надолго попала бы в кэш под новой версией ленты.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+
+STICKY_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _sticky_key(user_id):
+    return 'primary_until:{}'.format(user_id)
+
+
+@contextmanager
+def primary():
+    """Чтения внутри блока (или декорированной функции) идут в default."""
+    saved = getattr(_state, 'primary', True)
+    _state.primary = True
+    try:
+        yield
+    finally:
+        _state.primary = saved or getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = _replicas()
+        # вне запросов (команды, фоновые потоки) реплики не используются
+        if not replicas or getattr(_state, 'primary', True):
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.primary = _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # в репликах те же данные, что и в default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in _replicas()
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.primary = (request.method not in SAFE_METHODS
+                          or not _replicas() or self.sticky(request))
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.primary = True
+            _state.wrote = False
+        if wrote and _replicas():
+            self.stick(request, response)
+        return response
+
+    def sticky(self, request):
+        session = getattr(request, 'session', None)
+        user_id = session.get(SESSION_KEY) if session is not None else None
+        if user_id is not None:
+            sticky_until = cache.get(_sticky_key(user_id), 0)
+        else:
+            try:
+                sticky_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+            except ValueError:
+                sticky_until = 0
+        return sticky_until > time.time()
+
+    def stick(self, request, response):
+        seconds = settings.REPLICA_STICKY_SECONDS
+        sticky_until = time.time() + seconds
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cache.set(_sticky_key(user.pk), sticky_until, seconds)
+        else:
+            response.set_cookie(
+                STICKY_COOKIE, str(sticky_until), max_age=seconds,
+                httponly=True, samesite='Lax')
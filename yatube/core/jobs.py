@@ -0,0 +1,216 @@
+"""Очередь фоновых задач в таблице базы данных.
+
+Задача -- функция, помеченная декоратором @job; её ставят в очередь
+вызовом func.enqueue(*args, **kwargs). Чтобы задача не потерялась и не
+запустилась раньше, чем данные будут зафиксированы, ставить её нужно
+в одной transaction.atomic() с записью данных: так делают save()
+моделей постов и подписок (их сигналы ставят задачи) и представления.
+Аргументы должны сериализоваться в JSON.
+
+Воркеры (команда run_workers) забирают задачи по приоритету, арендуя их
+на JOBS_LEASE_SECONDS; пока задача выполняется, аренду каждую треть
+срока продлевает фоновый поток, а задачу упавшего воркера после конца
+аренды заберёт другой. Неудачная попытка повторяется с растущей
+задержкой, после max_attempts задача остаётся в таблице со статусом
+failed на JOBS_FAILED_KEEP_DAYS дней.
+
+При JOBS_EAGER задачи выполняются сразу при постановке (тесты).
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# сколько готовых задач перебирать, если соседние воркеры их перехватили
+CLAIM_CANDIDATES = 10
+# как часто простаивающий воркер удаляет старые неудачные задачи, секунды
+PRUNE_INTERVAL = 60 * 60
+
+_last_prune = 0.0
+
+
+def job(priority=0, max_attempts=None):
+    """Делает функцию задачей очереди."""
+    def decorator(func):
+        func.job_name = '{}.{}'.format(func.__module__, func.__qualname__)
+        func.job_priority = priority
+        func.job_max_attempts = max_attempts
+
+        def enqueue(*args, **kwargs):
+            return enqueue_job(func, args, kwargs)
+
+        func.enqueue = enqueue
+        return func
+    return decorator
+
+
+def enqueue_job(func, args=(), kwargs=None, priority=None, delay=None):
+    kwargs = kwargs or {}
+    if settings.JOBS_EAGER:
+        func(*args, **kwargs)
+        return None
+    return Job.objects.create(
+        name=func.job_name,
+        payload=json.dumps({'args': list(args), 'kwargs': kwargs}),
+        priority=func.job_priority if priority is None else priority,
+        max_attempts=(func.job_max_attempts
+                      or settings.JOBS_MAX_ATTEMPTS),
+        run_after=timezone.now() + (delay or timedelta()),
+    )
+
+
+def worker_id():
+    return '{}:{}:{}'.format(
+        socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def claim(worker):
+    """Арендует готовую задачу или возвращает None.
+
+    Аренда -- условный UPDATE по (status, run_after): из нескольких
+    воркеров, увидевших одну задачу, её получит только один.
+    """
+    now = timezone.now()
+    candidates = (Job.objects.filter(
+        status__in=[Job.QUEUED, Job.RUNNING], run_after__lte=now)
+        .order_by('-priority', 'pk')
+        .values_list('pk', 'status', 'run_after')[:CLAIM_CANDIDATES])
+    lease = _lease_end()
+    for pk, status, run_after in candidates:
+        claimed = Job.objects.filter(
+            pk=pk, status=status, run_after=run_after
+        ).update(status=Job.RUNNING, run_after=lease, locked_by=worker,
+                 attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def _lease_end():
+    return timezone.now() + timedelta(seconds=settings.JOBS_LEASE_SECONDS)
+
+
+def extend_lease(job, worker):
+    """Продлевает аренду; False, если задачу уже забрал другой воркер."""
+    return bool(Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=worker
+    ).update(run_after=_lease_end()))
+
+
+@contextmanager
+def heartbeat(job, worker):
+    """Продлевает аренду задачи, пока выполняется блок."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOBS_LEASE_SECONDS / 3):
+                if not extend_lease(job, worker):
+                    logger.warning('Аренда задачи %s потеряна', job)
+                    return
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True,
+                              name='job-heartbeat-{}'.format(job.pk))
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _retry_delay(attempts):
+    return timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _fail(job, worker, error):
+    mine = Job.objects.filter(pk=job.pk, locked_by=worker)
+    if job.attempts >= job.max_attempts:
+        # run_after у неудачной задачи -- время последней попытки
+        mine.update(status=Job.FAILED, locked_by='', last_error=error,
+                    run_after=timezone.now())
+        return Job.FAILED
+    mine.update(status=Job.QUEUED, locked_by='', last_error=error,
+                run_after=timezone.now() + _retry_delay(job.attempts))
+    return 'retry'
+
+
+def run(job, worker):
+    """Выполняет арендованную задачу; успешная удаляется из очереди."""
+    if job.attempts > job.max_attempts:
+        # воркеры падали на ней раньше, чем успевали записать ошибку
+        result = _fail(job, worker, 'Аренда истекла {} раз'.format(
+            job.max_attempts))
+    else:
+        try:
+            func = import_string(job.name)
+            if getattr(func, 'job_name', None) != job.name:
+                raise ValueError('{} не объявлена задачей'.format(job.name))
+            payload = json.loads(job.payload)
+            with heartbeat(job, worker):
+                func(*payload['args'], **payload['kwargs'])
+        except Exception:
+            logger.exception('Задача %s завершилась ошибкой', job)
+            result = _fail(job, worker, traceback.format_exc())
+        else:
+            Job.objects.filter(pk=job.pk, locked_by=worker).delete()
+            result = 'done'
+    metrics.inc('jobs_total', job=job.name, result=result)
+    return result
+
+
+def prune_failed():
+    """Удаляет неудачные задачи старше JOBS_FAILED_KEEP_DAYS."""
+    before = timezone.now() - timedelta(days=settings.JOBS_FAILED_KEEP_DAYS)
+    return Job.objects.filter(
+        status=Job.FAILED, run_after__lt=before).delete()[0]
+
+
+def _prune_if_due():
+    global _last_prune
+    if time.monotonic() - _last_prune > PRUNE_INTERVAL:
+        _last_prune = time.monotonic()
+        prune_failed()
+
+
+def work(stop, once=False):
+    """Цикл воркера: до stop или, при once, пока очередь не опустеет.
+
+    Возвращает число выполненных попыток.
+    """
+    worker = worker_id()
+    done = 0
+    while not stop.is_set():
+        job = claim(worker)
+        if job is not None:
+            run(job, worker)
+            done += 1
+            continue
+        _prune_if_due()
+        if once:
+            break
+        stop.wait(settings.JOBS_POLL_INTERVAL)
+    return done
+
+
+def run_pending():
+    """Выполняет в текущем потоке все готовые задачи."""
+    return work(threading.Event(), once=True)
@@ -0,0 +1,62 @@
+"""Отправка писем через очередь задач.
+
+QueuedEmailBackend только ставит письма в очередь core.jobs, поэтому
+запрос не ждёт почтовый сервер; задача send_email отправляет письмо
+через QUEUED_EMAIL_BACKEND и при ошибке повторяется. Задачи, которые
+сами рассылают много писем, отправляют их через deliver().
+"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .jobs import job
+
+QUEUED_BACKEND = 'core.mail.QueuedEmailBackend'
+
+
+def deliver(messages):
+    """Отправляет письма сразу, минуя очередь, одним соединением."""
+    backend = settings.EMAIL_BACKEND
+    if backend == QUEUED_BACKEND:
+        backend = settings.QUEUED_EMAIL_BACKEND
+    return get_connection(backend).send_messages(messages)
+
+
+def serialize(message):
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'cc': message.cc,
+        'bcc': message.bcc,
+        'reply_to': message.reply_to,
+        'headers': message.extra_headers,
+        'alternatives': getattr(message, 'alternatives', []),
+        'content_subtype': message.content_subtype,
+    }
+
+
+@job(priority=5)
+def send_email(data):
+    data = dict(data)
+    alternatives = data.pop('alternatives')
+    content_subtype = data.pop('content_subtype')
+    message = EmailMultiAlternatives(
+        alternatives=[tuple(item) for item in alternatives], **data)
+    message.content_subtype = content_subtype
+    deliver([message])
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        direct = []
+        for message in email_messages:
+            if message.attachments:
+                # вложения в JSON не помещаются, такие письма уходят сразу
+                direct.append(message)
+            else:
+                send_email.enqueue(serialize(message))
+        if direct:
+            deliver(direct)
+        return len(email_messages)
@@ -0,0 +1,80 @@
+import json
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache_backend import SQLiteCache
+
+# страница ленты -- типичное значение в нашем кэше
+PAGE = 'x' * 20000
+
+
+def backends(directory, max_entries):
+    options = {'OPTIONS': {'MAX_ENTRIES': max_entries}}
+    return {
+        'locmem': LocMemCache('benchmark', options),
+        'filebased': FileBasedCache(directory + '/files', options),
+        'sqlite': SQLiteCache(directory + '/cache.sqlite3', options),
+    }
+
+
+def operations(cache, keys):
+    def set_pages():
+        for key in keys:
+            cache.set(key, PAGE)
+
+    def get_hits():
+        for key in keys:
+            cache.get(key)
+
+    def get_misses():
+        for key in keys:
+            cache.get('missing:' + key)
+
+    def incr_versions():
+        cache.set('version', 1)
+        for _ in keys:
+            cache.incr('version')
+
+    def get_many():
+        for start in range(0, len(keys), 20):
+            cache.get_many(keys[start:start + 20])
+
+    return (
+        ('set', set_pages),
+        ('get_hit', get_hits),
+        ('get_miss', get_misses),
+        ('incr', incr_versions),
+        ('get_many_20', get_many),
+    )
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость LocMemCache, FileBasedCache и SQLiteCache '
+            'на операциях, которые делает сайт. Результат -- JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['operations']
+        keys = ['feed_page:index:{}'.format(index) for index in range(count)]
+        directory = tempfile.mkdtemp()
+        report = {}
+        try:
+            for name, cache in backends(directory, count * 2).items():
+                report[name] = {}
+                for operation, run in operations(cache, keys):
+                    started = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - started
+                    report[name][operation] = round(count / elapsed)
+                cache.clear()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.stdout.write(json.dumps(
+            {'operations': count, 'ops_per_second': report}, indent=2))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import jobs, workers
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди core.jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.JOBS_PROCESSES,
+            help='Число процессов; по умолчанию JOBS_PROCESSES.')
+        parser.add_argument(
+            '--threads', type=int, default=settings.JOBS_THREADS,
+            help='Потоков в процессе; по умолчанию JOBS_THREADS.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи в одном потоке и выйти.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(
+                'Выполнено задач: {}'.format(done)))
+            return
+        self.stdout.write('Воркеры: {} процесс(а) по {} поток(а)'.format(
+            options['processes'], options['threads']))
+        workers.serve(options['processes'], options['threads'])
@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплики из DATABASE_REPLICAS '
+            '(онлайн-копия через backup API).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help='Реплики; по умолчанию все из DATABASE_REPLICAS.')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Копирование умеет только SQLite; реплики '
+                               'других СУБД настраиваются репликацией СУБД.')
+        for alias in aliases:
+            if alias not in settings.DATABASE_REPLICAS:
+                raise CommandError('{} -- не реплика'.format(alias))
+            connections[alias].close()
+            source = sqlite3.connect(primary['NAME'])
+            target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            self.stdout.write(self.style.SUCCESS(
+                'Реплика {} обновлена'.format(alias)))
@@ -0,0 +1,322 @@
+"""Метрики запросов в формате Prometheus.
+
+MetricsMiddleware измеряет для каждого имени URL время ответа
+(гистограмма), число и время SQL-запросов, время рендера шаблонов и
+попадания в кэш. Каждый поток пишет в свой агрегатор, поэтому на запись
+блокировки не нужны; при чтении агрегаторы потоков складываются.
+
+Процессы WSGI-сервера раз в METRICS_FLUSH_INTERVAL секунд сбрасывают
+свои снимки в METRICS_DIR (файл <pid>-<случайная метка>.json, так что
+процесс с тем же pid не перепишет чужой снимок), а /metrics суммирует
+файлы живых процессов и удаляет снимки завершившихся.
+Команды управления пишут свои счётчики через inc().
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.base import Template
+
+# границы корзин гистограммы времени ответа, в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PREFIX = 'yatube_'
+HELP = {
+    'requests_total': ('counter', 'Обработанные запросы.'),
+    'request_duration_seconds': ('histogram', 'Время ответа.'),
+    'db_queries_total': ('counter', 'SQL-запросы.'),
+    'db_query_seconds_total': ('counter', 'Время SQL-запросов.'),
+    'template_render_seconds_total': ('counter', 'Время рендера шаблонов.'),
+    'cache_hits_total': ('counter', 'Попадания в кэш.'),
+    'cache_misses_total': ('counter', 'Промахи кэша.'),
+    'purge_deleted_total': ('counter', 'Строки и файлы, удалённые purge.'),
+    'purge_batches_total': ('counter', 'Порции удаления purge.'),
+    'jobs_total': ('counter', 'Попытки фоновых задач по результату.'),
+    'digest_emails_total': ('counter', 'Отправленные письма дайджеста.'),
+}
+
+_local = threading.local()
+_aggregators = []
+_installed = False
+_last_flush = 0.0
+# (pid, имя файла снимка) текущего процесса; после fork имя меняется
+_process = None
+_MISSING = object()
+
+
+class Aggregator:
+    """Счётчики одного потока; пишет в них только этот поток."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        key = name, labels
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # корзины, затем +Inf, сумма и число наблюдений
+            histogram = self.histograms[key] = [0] * (len(BUCKETS) + 3)
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def _aggregator():
+    aggregator = getattr(_local, 'aggregator', None)
+    if aggregator is None:
+        aggregator = _local.aggregator = Aggregator()
+        _aggregators.append(aggregator)
+    return aggregator
+
+
+def _merge(target, counters, histograms):
+    for key, value in counters:
+        target['counters'][key] = target['counters'].get(key, 0) + value
+    for key, values in histograms:
+        merged = target['histograms'].setdefault(key, [0] * len(values))
+        for index, value in enumerate(values):
+            merged[index] += value
+
+
+def snapshot():
+    """Сумма агрегаторов всех потоков текущего процесса."""
+    result = {'counters': {}, 'histograms': {}}
+    for aggregator in list(_aggregators):
+        _merge(result,
+               dict(aggregator.counters).items(),
+               [(key, list(values)) for key, values
+                in dict(aggregator.histograms).items()])
+    return result
+
+
+def _dump(data):
+    return json.dumps({
+        kind: [[name, list(labels), value]
+               for (name, labels), value in data[kind].items()]
+        for kind in ('counters', 'histograms')
+    })
+
+
+def _load(raw):
+    data = json.loads(raw)
+    return {
+        kind: [((name, tuple(map(tuple, labels))), value)
+               for name, labels, value in data[kind]]
+        for kind in ('counters', 'histograms')
+    }
+
+
+def _own_file():
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        _process = pid, '{}-{}.json'.format(pid, uuid.uuid4().hex)
+    return os.path.join(settings.METRICS_DIR, _process[1])
+
+
+def _snapshot_pid(name):
+    """pid процесса по имени файла снимка или None для чужих файлов."""
+    if not name.endswith('.json'):
+        return None
+    try:
+        return int(name[:-len('.json')].split('-')[0])
+    except ValueError:
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def flush():
+    """Сохраняет снимок процесса в METRICS_DIR."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, mode=0o700, exist_ok=True)
+    path = _own_file()
+    temp = '{}.{}.tmp'.format(path, threading.get_ident())
+    with open(temp, 'w') as output:
+        output.write(_dump(snapshot()))
+    os.replace(temp, path)
+
+
+def collect():
+    """Метрики всех процессов: свои -- живые, чужие -- из файлов.
+
+    Снимки завершившихся процессов удаляются: их pid больше не жив или
+    уже достался текущему процессу.
+    """
+    result = snapshot()
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        return result
+    own = _own_file()
+    for entry in os.scandir(settings.METRICS_DIR):
+        pid = _snapshot_pid(entry.name)
+        if pid is None or entry.path == own:
+            continue
+        if pid == os.getpid() or not _alive(pid):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(entry.path) as source:
+                data = _load(source.read())
+        except (OSError, ValueError):
+            continue
+        _merge(result, data['counters'], data['histograms'])
+    return result
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"'))
+        for name, value in pairs) + '}'
+
+
+def render(data):
+    """Текстовый формат Prometheus 0.0.4."""
+    series = defaultdict(list)
+    for (name, labels), value in sorted(data['counters'].items()):
+        series[name].append('{}{}{} {}'.format(
+            PREFIX, name, _labels(labels), value))
+    for (name, labels), values in sorted(data['histograms'].items()):
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), values):
+            total += count
+            series[name].append('{}{}_bucket{} {}'.format(
+                PREFIX, name, _labels(labels, [('le', bound)]), total))
+        series[name].append('{}{}_sum{} {}'.format(
+            PREFIX, name, _labels(labels), values[-2]))
+        series[name].append('{}{}_count{} {}'.format(
+            PREFIX, name, _labels(labels), values[-1]))
+    lines = []
+    for name in sorted(series):
+        kind, text = HELP.get(name, ('untyped', name))
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, text))
+        lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+        lines.extend(series[name])
+    return '\n'.join(lines) + '\n'
+
+
+def _flush_if_due():
+    if time.monotonic() - _last_flush > settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def inc(name, value=1, **labels):
+    """Счётчик вне запроса: команды и фоновые задачи."""
+    _aggregator().inc(name, tuple(sorted(labels.items())), value)
+    _flush_if_due()
+
+
+def _timed_render(render):
+    def wrapper(self, context):
+        stats = getattr(_local, 'request', None)
+        # вложенные шаблоны (include, extends) уже учтены во внешнем
+        if stats is None or stats['depth']:
+            return render(self, context)
+        stats['depth'] += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            stats['depth'] -= 1
+            stats['template'] += time.perf_counter() - started
+    return wrapper
+
+
+def _counted_get(get):
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version)
+        stats = getattr(_local, 'request', None)
+        if stats is not None:
+            stats['hits' if value is not _MISSING else 'misses'] += 1
+        return default if value is _MISSING else value
+    return wrapper
+
+
+def install():
+    """Подключает измерение шаблонов и кэша; вызывается один раз."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    Template.render = _timed_render(Template.render)
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        backend.get = _counted_get(backend.get)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.request = {
+            'depth': 0, 'template': 0.0, 'hits': 0, 'misses': 0,
+            'queries': 0, 'sql': 0.0,
+        }
+
+        def timed(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['sql'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timed))
+                response = self.get_response(request)
+        finally:
+            _local.request = None
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, duration, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = (('view', match.view_name if match else 'unresolved'),)
+        aggregator = _aggregator()
+        aggregator.inc('requests_total', view + (
+            ('method', request.method),
+            ('status', str(response.status_code))))
+        aggregator.observe('request_duration_seconds', view, duration)
+        aggregator.inc('db_queries_total', view, stats['queries'])
+        aggregator.inc('db_query_seconds_total', view, stats['sql'])
+        aggregator.inc('template_render_seconds_total', view,
+                       stats['template'])
+        aggregator.inc('cache_hits_total', view, stats['hits'])
+        aggregator.inc('cache_misses_total', view, stats['misses'])
+        _flush_if_due()
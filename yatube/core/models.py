@@ -0,0 +1,72 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """Фоновая задача очереди core.jobs.
+
+    Пока задача выполняется, run_after -- конец аренды: если воркер
+    упал, после этого времени задачу заберёт другой.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(
+        verbose_name='Функция',
+        max_length=200
+    )
+    payload = models.TextField(
+        verbose_name='Аргументы (JSON)',
+        default='{}'
+    )
+    priority = models.SmallIntegerField(
+        verbose_name='Приоритет',
+        default=0,
+        help_text='Задачи с большим приоритетом выполняются раньше'
+    )
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Максимум попыток',
+        default=5
+    )
+    run_after = models.DateTimeField(
+        verbose_name='Не раньше',
+        default=timezone.now
+    )
+    locked_by = models.CharField(
+        verbose_name='Воркер',
+        max_length=100,
+        blank=True
+    )
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True
+    )
+    created = models.DateTimeField(
+        verbose_name='Создана',
+        auto_now_add=True
+    )
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [models.Index(
+            fields=['status', 'run_after'], name='job_ready_idx')]
+
+    def __str__(self):
+        return '{} #{}'.format(self.name, self.pk)
@@ -0,0 +1,125 @@
+"""Бюджет SQL-запросов для представлений.
+
+Представление объявляет, сколько запросов ему положено:
+
+    @query_budget(6)
+    def post_detail(request, post_id):
+        ...
+
+QueryBudgetMiddleware считает запросы каждого ответа и повторяющийся SQL
+(один и тот же шаблон с разными параметрами -- признак N+1). Режим задаёт
+QUERY_BUDGET_MODE: 'off', 'log' (предупреждение в лог) или 'strict'
+(исключение). В тестах то же проверяет QueryBudgetTestMixin.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# одинаковые запросы, встретившиеся столько раз, считаются N+1
+DUPLICATE_LIMIT = 3
+WHITESPACE = re.compile(r'\s+')
+# точки сохранения в тестах идут внутри транзакции TestCase, в работе -- нет
+SAVEPOINT = re.compile(r'^\s*(?:RELEASE |ROLLBACK TO )?SAVEPOINT', re.I)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Объявляет максимальное число запросов представления."""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def get_budget(view):
+    return getattr(view, 'query_budget', None)
+
+
+@contextmanager
+def record_queries():
+    """Собирает SQL всех подключений в список, который и возвращает."""
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if not SAVEPOINT.match(sql):
+            queries.append(sql)
+        return execute(sql, params, many, context)
+
+    wrappers = [connection.execute_wrapper(record)
+                for connection in connections.all()]
+    for wrapper in wrappers:
+        wrapper.__enter__()
+    try:
+        yield queries
+    finally:
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
+
+
+def duplicates(queries, limit=DUPLICATE_LIMIT):
+    counts = Counter(WHITESPACE.sub(' ', sql).strip() for sql in queries)
+    return [(sql, count) for sql, count in counts.most_common()
+            if count >= limit]
+
+
+def check(name, queries, budget):
+    """Возвращает список нарушений бюджета или пустой список."""
+    problems = []
+    if budget is not None and len(queries) > budget:
+        problems.append('{}: {} запросов при бюджете {}'.format(
+            name, len(queries), budget))
+    for sql, count in duplicates(queries):
+        problems.append('{}: {} раз {}'.format(name, count, sql))
+    return problems
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off':
+            return self.get_response(request)
+        with record_queries() as queries:
+            response = self.get_response(request)
+        view = getattr(request, '_query_budget_view', None)
+        if view is None:
+            return response
+        name, budget = view
+        problems = check(name, queries, budget)
+        if problems and mode == 'strict':
+            raise QueryBudgetExceeded('\n'.join(problems))
+        for problem in problems:
+            logger.warning('%s %s', request.path, problem)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget_view = (
+            request.resolver_match.view_name, get_budget(view_func))
+
+
+class QueryBudgetTestMixin:
+    """Проверка бюджета запросов для TestCase."""
+
+    def assertWithinQueryBudget(self, path, method='get', data=None,
+                                client=None):
+        budget = get_budget(resolve(urlsplit(path).path).func)
+        self.assertIsNotNone(budget, 'У {} не объявлен бюджет'.format(path))
+        client = client or self.client
+        with record_queries() as queries:
+            response = getattr(client, method)(path, data or {})
+        problems = check(path, queries, budget)
+        self.assertFalse(problems, '\n'.join(problems + queries))
+        return response
@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from core.cache_backend import temporary_caches
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты с отдельными файлами кэша.
+
+    Кэш на SQLite переживает процесс, поэтому без этого тесты видели бы
+    записи прошлых запусков и портили бы кэш работающего сайта.
+    Снимки метрик тоже пишутся во временный каталог. Фоновые задачи
+    выполняются сразу (JOBS_EAGER), тесты очереди отключают это сами.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp()
+        self._test_settings = override_settings(
+            CACHES=temporary_caches(self._cache_dir), JOBS_EAGER=True,
+            METRICS_DIR=os.path.join(self._cache_dir, 'metrics'))
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,6 +1,26 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
-from django.test import TestCase
+from django.contrib.auth import SESSION_KEY
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings)
+from django.utils import timezone
+
+from core import db_router, jobs, metrics, query_budget
+from core.cache_backend import SQLiteCache
+from core.models import Job
 
 
 class ViewTestClass(TestCase):
@@ -8,3 +28,377 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_duplicates(self):
+        """повторяющийся SQL попадает в отчёт"""
+        queries = ['SELECT 1', 'SELECT  2'] + ['SELECT  x\n WHERE id = %s'] * 3
+        self.assertEqual(
+            query_budget.duplicates(queries), [('SELECT x WHERE id = %s', 3)])
+        problems = query_budget.check('view', queries, 4)
+        self.assertEqual(len(problems), 2)
+
+    @override_settings(QUERY_BUDGET_MODE='strict')
+    def test_strict_mode(self):
+        """в строгом режиме превышение бюджета -- ошибка"""
+        with mock.patch('posts.views.index.query_budget', 0):
+            with self.assertRaises(query_budget.QueryBudgetExceeded):
+                self.client.get('/')
+
+    @override_settings(QUERY_BUDGET_MODE='log')
+    def test_log_mode(self):
+        """в режиме log превышение бюджета пишется в лог"""
+        with mock.patch('posts.views.index.query_budget', 0):
+            with self.assertLogs('core.query_budget', 'WARNING'):
+                response = self.client.get('/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+
+    def test_metrics_endpoint(self):
+        """/metrics отдаёт время ответа, SQL, шаблоны и кэш по имени URL"""
+        self.client.get('/')
+        self.client.get('/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        text = response.content.decode()
+        for line in (
+            'yatube_request_duration_seconds_bucket{view="posts:index",'
+            'le="+Inf"}',
+            'yatube_requests_total{view="posts:index",method="GET",'
+            'status="200"}',
+            'yatube_db_queries_total{view="posts:index"}',
+            'yatube_template_render_seconds_total{view="posts:index"}',
+            'yatube_cache_hits_total{view="posts:index"}',
+            'yatube_cache_misses_total{view="posts:index"}',
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, text)
+
+    def test_metrics_internal_only(self):
+        """чужим адресам /metrics не показывается"""
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_worker_snapshots_are_summed(self):
+        """метрики других процессов складываются с текущими"""
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            before = metrics.collect()['counters']
+            key = ('requests_total', (('view', 'posts:index'),
+                                      ('method', 'GET'), ('status', '200')))
+            other = {'counters': {key: 5}, 'histograms': {}}
+            name = '{}-other.json'.format(os.getppid())
+            with open(os.path.join(self.metrics_dir, name), 'w') as out:
+                out.write(metrics._dump(other))
+            after = metrics.collect()['counters']
+        self.assertEqual(after[key], before.get(key, 0) + 5)
+
+    def test_dead_process_snapshots_removed(self):
+        """снимки завершившихся процессов удаляются и не суммируются"""
+        process = subprocess.Popen(['true'])
+        process.wait()
+        key = ('requests_total', (('view', 'posts:index'),
+                                  ('method', 'GET'), ('status', '200')))
+        other = metrics._dump({'counters': {key: 5}, 'histograms': {}})
+        names = ['{}-dead.json'.format(process.pid),
+                 # прежний процесс с тем же pid, что у текущего
+                 '{}-old.json'.format(os.getpid())]
+        for name in names:
+            with open(os.path.join(self.metrics_dir, name), 'w') as out:
+                out.write(other)
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            before = metrics.snapshot()['counters'].get(key, 0)
+            after = metrics.collect()['counters'].get(key, 0)
+        self.assertEqual(after, before)
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.location = os.path.join(directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_private_file(self):
+        """файл кэша доступен только владельцу"""
+        self.cache.set('session', 'secret')
+        self.assertEqual(os.stat(self.location).st_mode & 0o777, 0o600)
+        os.chmod(self.location, 0o644)
+        self.make_cache().get('session')
+        self.assertEqual(os.stat(self.location).st_mode & 0o777, 0o600)
+
+    def test_old_sqlite(self):
+        """со старым SQLite бэкенд не создаётся"""
+        with mock.patch('sqlite3.sqlite_version_info', (3, 31, 1)):
+            with self.assertRaises(ImproperlyConfigured):
+                self.make_cache()
+
+    def test_basic_operations(self):
+        """set/get/add/delete/get_many работают как у встроенных кэшей"""
+        self.cache.set('page', {'html': '<p>'})
+        self.assertEqual(self.cache.get('page'), {'html': '<p>'})
+        self.assertFalse(self.cache.add('page', 'другое'))
+        self.assertTrue(self.cache.add('new', 1))
+        self.assertEqual(self.cache.get_many(['page', 'new', 'none']),
+                         {'page': {'html': '<p>'}, 'new': 1})
+        self.cache.delete('page')
+        self.assertIsNone(self.cache.get('page'))
+        self.cache.set('short', 1, timeout=0)
+        self.assertEqual(self.cache.get('short', 'нет'), 'нет')
+
+    def test_shared_between_instances(self):
+        """записи и инкременты видны другим процессам с тем же файлом"""
+        other = self.make_cache()
+        self.cache.set('version', 1)
+        self.assertEqual(other.incr('version'), 2)
+        self.assertEqual(self.cache.get('version'), 2)
+        with self.assertRaises(ValueError):
+            other.incr('missing')
+
+    def test_incr_is_atomic(self):
+        """параллельные incr не теряют обновлений"""
+        self.cache.set('version', 0)
+
+        def bump():
+            cache = self.make_cache()
+            for _ in range(50):
+                cache.incr('version')
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('version'), 200)
+
+    def test_lru_eviction(self):
+        """при переполнении вытесняются давно не читанные записи"""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        with mock.patch('core.cache_backend.time.time', return_value=100):
+            for key in 'abc':
+                cache.set(key, key, timeout=None)
+        with mock.patch('core.cache_backend.time.time', return_value=200):
+            cache.get('a')
+            cache.set('d', 'd', timeout=None)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a')
+        self.assertEqual(cache.get('d'), 'd')
+
+    def test_size_limit(self):
+        """объём кэша не превышает MAX_SIZE"""
+        cache = self.make_cache(MAX_SIZE=50000)
+        for index in range(10):
+            cache.set(index, 'x' * 10000)
+        stored = cache.get_many(range(10))
+        self.assertLessEqual(len(stored), 5)
+        self.assertIn(9, stored)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def route(self, request, write=False):
+        """Выполняет запрос, возвращает базу для чтения и ответ."""
+        used = []
+
+        def view(request):
+            used.append(self.router.db_for_read(None))
+            if write:
+                self.router.db_for_write(None)
+                used.append(self.router.db_for_read(None))
+            return HttpResponse()
+
+        response = db_router.ReplicaMiddleware(view)(request)
+        return used, response
+
+    def test_reads_go_to_replica(self):
+        """чтение в запросе идёт на реплику, вне запроса -- в default"""
+        used, response = self.route(self.factory.get('/'))
+        self.assertEqual(used, ['replica'])
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_read_your_writes(self):
+        """после записи чтения идут в default, пока действует cookie"""
+        used, response = self.route(self.factory.get('/'), write=True)
+        self.assertEqual(used, ['replica', 'default'])
+        cookie = response.cookies[db_router.STICKY_COOKIE]
+        self.assertEqual(self.router.db_for_write(None), 'default')
+
+        request = self.factory.get('/')
+        request.COOKIES[db_router.STICKY_COOKIE] = cookie.value
+        used, response = self.route(request)
+        self.assertEqual(used, ['default'])
+
+    def test_sticky_per_user(self):
+        """после записи пользователь читает из default с любого устройства"""
+        user = mock.Mock(pk=7, is_authenticated=True)
+        request = self.factory.post('/')
+        request.user = user
+        used, response = self.route(request, write=True)
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+
+        other_device = self.factory.get('/')
+        other_device.session = {SESSION_KEY: '7'}
+        used, response = self.route(other_device)
+        self.assertEqual(used, ['default'])
+        stranger = self.factory.get('/')
+        stranger.session = {SESSION_KEY: '8'}
+        used, response = self.route(stranger)
+        self.assertEqual(used, ['replica'])
+
+    def test_primary_block(self):
+        """в primary() чтения идут в default, после него -- снова реплика"""
+        used = []
+
+        def view(request):
+            with db_router.primary():
+                used.append(self.router.db_for_read(None))
+            used.append(self.router.db_for_read(None))
+            return HttpResponse()
+
+        db_router.ReplicaMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(used, ['default', 'replica'])
+
+    def test_post_reads_primary(self):
+        """POST-запросы читают из основной базы"""
+        used, response = self.route(self.factory.post('/'))
+        self.assertEqual(used, ['default'])
+
+    def test_no_migrations_on_replicas(self):
+        """реплики не мигрируются, они копии default"""
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+        self.assertTrue(self.router.allow_migrate('default', 'posts'))
+
+
+CALLS = []
+
+
+@jobs.job()
+def remember(value):
+    CALLS.append(value)
+
+
+@jobs.job(max_attempts=2)
+def broken():
+    raise RuntimeError('сломалась')
+
+
+@override_settings(JOBS_EAGER=False)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_run_and_delete(self):
+        """задача выполняется воркером и уходит из очереди"""
+        remember.enqueue('раз')
+        self.assertEqual(CALLS, [])
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(CALLS, ['раз'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_priority(self):
+        """задачи с большим приоритетом выполняются раньше"""
+        remember.enqueue('обычная')
+        jobs.enqueue_job(remember, ['срочная'], priority=10)
+        jobs.enqueue_job(remember, ['отложенная'],
+                         delay=timedelta(minutes=5))
+        jobs.run_pending()
+        self.assertEqual(CALLS, ['срочная', 'обычная'])
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+    def test_retry_then_fail(self):
+        """ошибка откладывает повтор, после max_attempts задача failed"""
+        job = broken.enqueue()
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('сломалась', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_lease(self):
+        """арендованную задачу не берёт другой воркер, пока аренда идёт"""
+        remember.enqueue('раз')
+        job = jobs.claim('first')
+        self.assertEqual(job.locked_by, 'first')
+        self.assertIsNone(jobs.claim('second'))
+        # первый воркер упал: аренда истекла
+        Job.objects.update(run_after=timezone.now())
+        job = jobs.claim('second')
+        self.assertEqual((job.locked_by, job.attempts), ('second', 2))
+        self.assertEqual(jobs.run(job, 'second'), 'done')
+        self.assertEqual(CALLS, ['раз'])
+
+    def test_extend_lease(self):
+        """продлённую аренду не перехватывают, чужую не продлить"""
+        remember.enqueue('раз')
+        job = jobs.claim('first')
+        Job.objects.update(run_after=timezone.now())
+        self.assertTrue(jobs.extend_lease(job, 'first'))
+        self.assertIsNone(jobs.claim('second'))
+        self.assertFalse(jobs.extend_lease(job, 'second'))
+
+    @override_settings(JOBS_LEASE_SECONDS=0.03)
+    def test_heartbeat(self):
+        """пока задача выполняется, аренда продлевается"""
+        job = Job(pk=1)
+        with mock.patch.object(jobs, 'extend_lease',
+                               return_value=True) as extend:
+            with jobs.heartbeat(job, 'first'):
+                threading.Event().wait(0.1)
+        self.assertGreaterEqual(extend.call_count, 2)
+        extend.assert_called_with(job, 'first')
+
+    def test_prune_failed(self):
+        """неудачные задачи удаляются через JOBS_FAILED_KEEP_DAYS"""
+        now = timezone.now()
+        old, fresh = [Job.objects.create(
+            name='x', payload='{}', status=Job.FAILED, run_after=when)
+            for when in (now - timedelta(days=31), now - timedelta(days=1))]
+        queued = Job.objects.create(
+            name='x', payload='{}', run_after=now - timedelta(days=31))
+        with self.settings(JOBS_FAILED_KEEP_DAYS=30):
+            self.assertEqual(jobs.prune_failed(), 1)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)),
+                         {fresh.pk, queued.pk})
+
+    @override_settings(
+        EMAIL_BACKEND='core.mail.QueuedEmailBackend',
+        QUEUED_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_queued_email(self):
+        """письмо уходит не в запросе, а задачей очереди"""
+        mail.send_mail('Тема', 'Текст', 'site@example.com',
+                       ['user@example.com'])
+        self.assertEqual(mail.outbox, [])
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertIn('Выполнено задач: 1', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Тема')
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
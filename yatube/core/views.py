@@ -1,7 +1,11 @@
 from http import HTTPStatus
 
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from . import metrics as request_metrics
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path},
@@ -20,3 +24,12 @@ def server_error(request):
 def forbidden(request, exception):
     return render(request, 'core/403.html',
                   status=HTTPStatus.FORBIDDEN)
+
+
+def metrics(request):
+    """Метрики Prometheus, доступные только с адресов INTERNAL_IPS."""
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(
+        request_metrics.render(request_metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,62 @@
+"""Пул процессов и потоков, выполняющих задачи core.jobs.
+
+Дочерние процессы запускаются через spawn и импортируют этот модуль до
+django.setup(), поэтому модели здесь не импортируются.
+"""
+import multiprocessing
+import signal
+import threading
+
+
+def _work(stop):
+    from django.db import connections
+    from . import jobs
+
+    try:
+        jobs.work(stop)
+    finally:
+        connections.close_all()
+
+
+def run_threads(threads):
+    """Запускает потоки-воркеры текущего процесса и ждёт их."""
+    stop = threading.Event()
+    # SIGTERM и Ctrl+C: дописать текущие задачи и выйти
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    workers = [threading.Thread(target=_work, args=(stop,),
+                                name='job-worker-{}'.format(index))
+               for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _child(threads):
+    import django
+    django.setup()
+    run_threads(threads)
+
+
+def serve(processes, threads):
+    """processes процессов по threads потоков; до SIGTERM или Ctrl+C."""
+    if processes <= 1:
+        run_threads(threads)
+        return
+    context = multiprocessing.get_context('spawn')
+    children = [context.Process(target=_child, args=(threads,),
+                                name='job-process-{}'.format(index))
+                for index in range(processes)]
+    for child in children:
+        child.start()
+
+    def stop(*args):
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        child.join()
@@ -1,25 +1,78 @@
 from django.contrib import admin
 
-from .models import Post, Group, Comment, Follow
+from .models import Comment, Digest, Follow, Group, Post, PurgeCheckpoint
+from .search import matching_comment_ids, matching_post_ids
+from .utils import EstimatedCountPaginator
+
+
+class FullTextSearchMixin:
+    """Поиск в списке объектов через полнотекстовый индекс, а не LIKE.
+
+    Находятся все совпадения: индекс фильтрует список подзапросом, без
+    предела SEARCH_MAX_RESULTS, которым ограничен поиск на сайте.
+    """
+    search_ids = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        ids = self.search_ids(search_term)
+        return queryset.filter(pk__in=ids), False
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список объектов без точного COUNT(*) по большой таблице.
+
+    Число найденных строк берёт EstimatedCountPaginator, а общее число
+    строк без фильтров не считается вовсе.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(FullTextSearchMixin, LargeTableAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
+    search_ids = staticmethod(matching_post_ids)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
     list_editable = ('group',)
     list_per_page = 20
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'group':
+            # варианты выбора группы читаются один раз на страницу, а не
+            # в каждой строке list_editable
+            choices = getattr(request, '_group_choices', None)
+            if choices is None:
+                choices = request._group_choices = [
+                    choice for choice in field.choices]
+            field.choices = choices
+        return field
+
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, LargeTableAdmin):
     list_display = ('pk', 'text', 'post', 'author', 'created',)
+    list_select_related = ('post', 'author')
     search_fields = ('text',)
+    search_ids = staticmethod(matching_comment_ids)
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
 
 admin.site.register(Group)
 admin.site.register(Follow)
+
+
+@admin.register(PurgeCheckpoint)
+class PurgeCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('name', 'stage', 'deleted', 'updated', 'finished')
+
+
+@admin.register(Digest)
+class DigestAdmin(admin.ModelAdmin):
+    list_display = ('until', 'since', 'followers', 'created')
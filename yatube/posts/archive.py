@@ -0,0 +1,84 @@
+"""Перенос старых постов в архивные таблицы.
+
+Почти все чтения приходятся на свежие посты, поэтому посты старше
+POSTS_ARCHIVE_AFTER_DAYS вместе с комментариями переезжают в
+ArchivedPost и ArchivedComment, а posts_post и его индексы остаются
+небольшими. Перенос идёт порциями, каждая -- отдельная короткая
+транзакция, так что запись на сайте не ждёт весь перенос.
+
+Сигналы удаления при переносе не отправляются: пост не исчезает, а
+меняет таблицу. id сохраняются, поэтому поисковый индекс и счётчики
+трогать не нужно; из материализованных лент подписок пост уходит.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache
+from .models import (ArchivedComment, ArchivedPost, Comment, Group, Post,
+                     TimelineEntry, User)
+
+BATCH_SIZE = 500
+POST_FIELDS = ('id', 'text', 'pub_date', 'updated', 'author_id', 'group_id',
+               'image', 'thumbnail', 'comments_count')
+COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'text', 'created')
+
+
+def cutoff(days=None):
+    if days is None:
+        days = settings.POSTS_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def _raw_delete(queryset):
+    # без сбора объектов и сигналов: связанные строки удалены заранее
+    return queryset._raw_delete(queryset.db)
+
+
+def archive_batch(before, batch_size=BATCH_SIZE):
+    """Переносит до batch_size самых старых постов, созданных до before.
+
+    Возвращает число перенесённых постов.
+    """
+    with transaction.atomic():
+        ids = list(Post.objects.filter(pub_date__lt=before)
+                   .order_by('pub_date', 'pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        ArchivedPost.objects.bulk_create(
+            ArchivedPost(**row) for row in
+            Post.objects.filter(pk__in=ids).values(*POST_FIELDS))
+        ArchivedComment.objects.bulk_create(
+            ArchivedComment(**row) for row in
+            Comment.objects.filter(post_id__in=ids).values(*COMMENT_FIELDS))
+        slugs = list(Group.objects.filter(posts__in=ids)
+                     .values_list('slug', flat=True).distinct())
+        usernames = list(User.objects.filter(posts__in=ids)
+                         .values_list('username', flat=True).distinct())
+        _raw_delete(TimelineEntry.objects.filter(post_id__in=ids))
+        _raw_delete(Comment.objects.filter(post_id__in=ids))
+        _raw_delete(Post.objects.filter(pk__in=ids))
+    # главная и группы больше не показывают посты, а страницы постов и
+    # профили показывают их уже архивными, без формы комментария
+    cache.bump(cache.index_feed(), *map(cache.group_feed, slugs),
+               *map(cache.profile_feed, usernames),
+               *map(cache.post_feed, ids))
+    return len(ids)
+
+
+def archive_posts(before, batch_size=BATCH_SIZE, pause=0):
+    """Переносит порциями все посты до before; отдаёт размеры порций.
+
+    pause -- секунды между порциями, чтобы не занимать базу целиком.
+    """
+    while True:
+        moved = archive_batch(before, batch_size)
+        if not moved:
+            return
+        yield moved
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,243 @@
+"""Синтетическая нагрузка на представления постов.
+
+generate() детерминированно (по seed) наполняет базу пользователями,
+группами, постами, комментариями и подписками, Runner прогоняет
+запросы через WSGI-приложение со всеми middleware и собирает задержки
+и число SQL-запросов на запрос.
+"""
+import math
+import random
+import statistics
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.middleware.csrf import _get_new_csrf_token
+from django.test import Client, RequestFactory
+from django.utils import timezone
+
+from . import counters, search
+from .models import Comment, Follow, Group, Post
+from .utils import keep_dates
+
+User = get_user_model()
+
+WORDS = (
+    'лето город река вечер дорога книга поезд окно море сад ветер '
+    'утро письмо дом свет лес дождь чай кот друг музыка снег небо'
+).split()
+FOLLOW_SHAPES = ('uniform', 'popular')
+# прозрачный GIF 2x1, его достаточно для миниатюр
+IMAGE = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C\x0A\x00\x3B'
+)
+START = timezone.make_aware(datetime(2021, 1, 1))
+
+Dataset = namedtuple('Dataset', 'usernames slugs posts')
+Scenario = namedtuple('Scenario', 'name method login build')
+
+
+def _text(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _follow_targets(rng, user_index, users, count, shape):
+    if shape == 'popular':
+        # первые пользователи популярнее остальных (закон Ципфа)
+        weights = [1 / (rank + 1) for rank in range(users)]
+        chosen = set(rng.choices(range(users), weights, k=count))
+    else:
+        chosen = set(rng.sample(range(users), min(count, users)))
+    chosen.discard(user_index)
+    return sorted(chosen)
+
+
+def generate(users=100, groups=10, posts=2000, comments=5000,
+             follows_per_user=10, follow_shape='popular', image_share=0.1,
+             group_share=0.7, seed=0):
+    """Наполняет базу; одинаковые параметры дают одинаковые данные."""
+    rng = random.Random(seed)
+    with transaction.atomic(), keep_dates():
+        User.objects.bulk_create([
+            User(username='bench{}'.format(index), password='!',
+                 first_name='Автор', last_name=str(index))
+            for index in range(users)
+        ])
+        user_ids = list(User.objects.filter(
+            username__startswith='bench').order_by('pk')
+            .values_list('pk', flat=True))
+        Group.objects.bulk_create([
+            Group(slug='bench-{}'.format(index),
+                  title='Группа {}'.format(index),
+                  description=_text(rng))
+            for index in range(groups)
+        ])
+        group_ids = list(Group.objects.filter(
+            slug__startswith='bench-').order_by('pk')
+            .values_list('pk', flat=True))
+
+        image = None
+        if image_share > 0:
+            image = default_storage.save(
+                'posts/bench.gif', ContentFile(IMAGE))
+        batch = []
+        for index in range(posts):
+            pub_date = START + timedelta(minutes=index)
+            has_group = group_ids and rng.random() < group_share
+            has_image = image and rng.random() < image_share
+            batch.append(Post(
+                text=_text(rng, rng.randint(5, 60)),
+                author_id=rng.choice(user_ids),
+                group_id=rng.choice(group_ids) if has_group else None,
+                image=image if has_image else '',
+                pub_date=pub_date,
+                updated=pub_date,
+            ))
+        Post.objects.bulk_create(batch)
+        post_rows = list(Post.objects.order_by('pk').values_list(
+            'pk', 'pub_date'))
+
+        batch = []
+        for _ in range(comments if post_rows else 0):
+            post_id, pub_date = rng.choice(post_rows)
+            batch.append(Comment(
+                post_id=post_id,
+                author_id=rng.choice(user_ids),
+                text=_text(rng, rng.randint(3, 20)),
+                created=pub_date + timedelta(seconds=rng.randint(1, 86400)),
+            ))
+        Comment.objects.bulk_create(batch)
+
+        batch = []
+        for user_index, user_id in enumerate(user_ids):
+            targets = _follow_targets(
+                rng, user_index, len(user_ids), follows_per_user,
+                follow_shape)
+            batch.extend(Follow(user_id=user_id, author_id=user_ids[target])
+                         for target in targets)
+        Follow.objects.bulk_create(batch)
+
+    # bulk_create не шлёт сигналы: производные данные считаем разом
+    counters.reconcile()
+    call_command('rebuild_timelines', stdout=StringIO())
+    search.rebuild()
+    cache.clear()
+
+
+def load_dataset():
+    posts = list(Post.objects.order_by('pk').values_list(
+        'pk', 'author__username'))
+    return Dataset(
+        usernames=list(User.objects.filter(posts__isnull=False).distinct()
+                       .order_by('pk').values_list('username', flat=True)),
+        slugs=list(Group.objects.order_by('pk')
+                   .values_list('slug', flat=True)),
+        posts=posts,
+    )
+
+
+SCENARIOS = (
+    Scenario('index', 'get', False, lambda rng, data: ('/', None)),
+    Scenario('group_posts', 'get', False, lambda rng, data: (
+        '/group/{}/'.format(rng.choice(data.slugs)), None)),
+    Scenario('profile', 'get', False, lambda rng, data: (
+        '/profile/{}/'.format(rng.choice(data.usernames)), None)),
+    Scenario('post_detail', 'get', False, lambda rng, data: (
+        '/posts/{}/'.format(rng.choice(data.posts)[0]), None)),
+    Scenario('follow_index', 'get', True, lambda rng, data: (
+        '/follow/', None)),
+    Scenario('post_create', 'post', True, lambda rng, data: (
+        '/create/', {'text': _text(rng)})),
+    Scenario('add_comment', 'post', True, lambda rng, data: (
+        '/posts/{}/comment/'.format(rng.choice(data.posts)[0]),
+        {'text': _text(rng, 6)})),
+)
+
+
+def percentile(values, share):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(math.ceil(share * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Runner:
+    """Выполняет запросы через WSGIHandler, как настоящий сервер."""
+
+    def __init__(self, username, seed=0, cold=False):
+        self.handler = WSGIHandler()
+        self.rng = random.Random(seed)
+        self.cold = cold
+        self.anonymous = RequestFactory()
+        self.authorized = RequestFactory()
+        client = Client()
+        client.force_login(User.objects.get(username=username))
+        self.csrf_token = _get_new_csrf_token()
+        self.authorized.cookies[settings.SESSION_COOKIE_NAME] = (
+            client.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.authorized.cookies[settings.CSRF_COOKIE_NAME] = self.csrf_token
+
+    def request(self, scenario, dataset):
+        path, data = scenario.build(self.rng, dataset)
+        factory = self.authorized if scenario.login else self.anonymous
+        if scenario.method == 'post':
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token)
+            environ = factory.post(path, data).environ
+        else:
+            environ = factory.get(path).environ
+        if self.cold:
+            cache.clear()
+
+        queries = []
+        status = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def start_response(code, headers, exc_info=None):
+            status.append(int(code.split()[0]))
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            response = self.handler(environ, start_response)
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), status[0]
+
+    def run(self, scenario, dataset, requests, warmup=0):
+        for _ in range(warmup):
+            self.request(scenario, dataset)
+        timings, queries, statuses = [], [], Counter()
+        for _ in range(requests):
+            elapsed, count, status = self.request(scenario, dataset)
+            timings.append(elapsed)
+            queries.append(count)
+            statuses[str(status)] += 1
+        total = sum(timings)
+        return {
+            'requests': requests,
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'mean_ms': round(total / requests * 1000, 3),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+            'throughput_rps': round(requests / total, 1) if total else None,
+            'statuses': dict(statuses),
+        }
@@ -0,0 +1,112 @@
+"""Кэш страниц лент с версиями вместо короткого TTL.
+
+У каждой ленты (главная, группа, профиль) есть счётчик версии, который
+увеличивают сигналы при изменении постов, комментариев, групп и подписок.
+Версия входит в ключ страницы, поэтому после записи старые страницы
+просто перестают читаться и доживают в кэше до вытеснения.
+
+Версии живут FEED_VERSION_TIMEOUT: ключ создаётся при первом чтении
+ленты, ещё до проверки, что группа или автор существуют. Истёкшая
+версия начинается заново с текущего времени и не совпадает со старой.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.db_router import primary
+from .utils import is_fragment
+
+
+def index_feed():
+    return 'index'
+
+
+def group_feed(slug):
+    return 'group:{}'.format(slug)
+
+
+def profile_feed(username):
+    return 'profile:{}'.format(username)
+
+
+def post_feed(post_id):
+    return 'post:{}'.format(post_id)
+
+
+def _version_key(feed):
+    return 'feed_version:{}'.format(feed)
+
+
+def _changed_key(feed):
+    return 'feed_changed:{}'.format(feed)
+
+
+def _initial_version():
+    # после вытеснения счётчика версия не должна совпасть со старой
+    return int(time.time() * 1000)
+
+
+def get_version(feed):
+    key = _version_key(feed)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), settings.FEED_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_changed(feed):
+    """Время последнего изменения ленты.
+
+    Если отметка истекла, изменением считается текущий момент: время
+    не должно уйти назад от того, что клиент уже видел.
+    """
+    key = _changed_key(feed)
+    changed = cache.get(key)
+    if changed is None:
+        cache.add(key, timezone.now(), settings.FEED_VERSION_TIMEOUT)
+        changed = cache.get(key)
+    return changed
+
+
+def bump(*feeds):
+    now = timezone.now()
+    timeout = settings.FEED_VERSION_TIMEOUT
+    for feed in feeds:
+        try:
+            cache.incr(_version_key(feed))
+        except ValueError:
+            cache.set(_version_key(feed), _initial_version(), timeout)
+        cache.set(_changed_key(feed), now, timeout)
+
+
+def cache_feed(feed, url_kwarg=None):
+    """Кэширует страницы ленты для анонимных посетителей.
+
+    feed -- одна из функций *_feed, url_kwarg -- аргумент URL для неё.
+    Фрагменты бесконечной прокрутки не кэшируются: кэш остаётся
+    за первыми заходами.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET' or request.user.is_authenticated
+                    or is_fragment(request)):
+                return view(request, *args, **kwargs)
+            name = feed(kwargs[url_kwarg]) if url_kwarg else feed()
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = 'feed_page:{}:{}:{}'.format(name, get_version(name), path)
+            response = cache.get(key)
+            if response is None:
+                # страница проживёт в кэше часы: читаем не с реплики
+                with primary():
+                    response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response, settings.FEED_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
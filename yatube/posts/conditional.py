@@ -0,0 +1,99 @@
+"""Валидаторы для условных GET-запросов (ETag и Last-Modified).
+
+ETag строится из версии ленты в кэше и адреса запроса, поэтому его
+проверка не стоит ни одного запроса к базе. Last-Modified -- самая
+свежая дата публикации, взятая одним запросом по индексу, или время
+последнего изменения ленты из кэша, если оно позже.
+
+HTML-страница зависит ещё и от посетителя (шапка, кнопка подписки,
+CSRF-токен в формах), поэтому page_etag добавляет к версии ленты
+пользователя и cookie CSRF, а Last-Modified у таких страниц нет:
+If-Modified-Since отдал бы одному посетителю страницу другого.
+"""
+import hashlib
+
+from django.middleware.csrf import get_token
+from django.db.models import Max
+
+from . import cache, timeline
+from .models import ArchivedPost, Post
+from .utils import COUNT_POSTS, CursorPaginator
+
+
+def make_etag(*parts):
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def feed_etag(request, feed, *extra):
+    return make_etag(
+        feed, cache.get_version(feed), request.get_full_path(), *extra)
+
+
+def page_etag(request, feed, *extra):
+    # cookie CSRF заводится до рендера, иначе первый ответ получил бы
+    # ETag без неё и следующий запрос с cookie его бы не совпал
+    get_token(request)
+    return feed_etag(request, feed, request.user.pk,
+                     request.META['CSRF_COOKIE'], *extra)
+
+
+def post_page_etag(request, post_id):
+    """ETag страницы поста.
+
+    Кроме поста и комментариев (post_feed) на ней счётчики автора,
+    которые меняют версию его профиля, и название группы.
+    """
+    row = None
+    for model in (Post, ArchivedPost):
+        row = (model.objects.filter(pk=post_id)
+               .values_list('author__username', 'group__slug').first())
+        if row is not None:
+            break
+    else:
+        return None
+    username, slug = row
+    return page_etag(
+        request, cache.post_feed(post_id),
+        cache.get_version(cache.profile_feed(username)),
+        slug and cache.get_version(cache.group_feed(slug)))
+
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def feed_last_modified(feed, queryset):
+    newest = queryset.order_by().aggregate(newest=Max('pub_date'))['newest']
+    return _latest(newest, cache.get_changed(feed))
+
+
+def post_last_modified(post_id):
+    row = (Post.objects.filter(pk=post_id)
+           .annotate(last_comment=Max('comments__created'))
+           .values_list('updated', 'last_comment').first())
+    if row is None:
+        row = (ArchivedPost.objects.filter(pk=post_id)
+               .annotate(last_comment=Max('comments__created'))
+               .values_list('updated', 'last_comment').first())
+    if row is None:
+        return None
+    return _latest(*row, cache.get_changed(cache.post_feed(post_id)))
+
+
+def timeline_state(request, posts):
+    """Всё, что видно на запрошенной странице ленты подписок.
+
+    Лента своя у каждого пользователя и версии в кэше у неё нет, поэтому
+    состояние -- строки самой страницы (тот же запрос по индексу, что и у
+    пагинатора): правки постов, число комментариев, автор и группа.
+    """
+    page = CursorPaginator(
+        posts.select_related('author', 'group').only(
+            'pk', 'pub_date', 'updated', 'comments_count',
+            'author__username', 'group__slug'),
+        COUNT_POSTS, field=timeline.ORDER_FIELD).get_page(request.GET)
+    return (
+        [(post.pk, post.updated, post.comments_count, post.author.username,
+          post.group.slug if post.group_id else None) for post in page],
+        page.next_cursor, page.previous_cursor)
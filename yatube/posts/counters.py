@@ -0,0 +1,91 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET x = x + 1 в обработчиках
+сигналов, а reconcile() пересчитывает их с нуля и исправляет расхождения.
+Сигналы срабатывают в транзакции записи строки: save() постов,
+комментариев и подписок обёрнут в transaction.atomic(), delete() Django
+сам выполняет в транзакции.
+"""
+import operator
+from functools import reduce
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import (ArchivedComment, ArchivedPost, AuthorStats, Comment,
+                     Follow, Post)
+
+User = get_user_model()
+
+# счётчик постов учитывает и перенесённые в архив
+STATS_FIELDS = (
+    ('posts_count', (Post, ArchivedPost), 'author'),
+    ('followers_count', (Follow,), 'author'),
+    ('following_count', (Follow,), 'user'),
+)
+
+
+def bump_stats(user_id, field, delta):
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta})
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta)
+
+
+def _real_count(model, field, outer='pk'):
+    counts = (model.objects.filter(**{field: OuterRef(outer)})
+              .order_by()
+              .values(field)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def _real_total(models, field, outer='pk'):
+    return reduce(operator.add, [
+        _real_count(model, field, outer) for model in models])
+
+
+def recount_archived_comments(post_ids):
+    """Счётчики комментариев архивных постов: сигналы их не ведут."""
+    ArchivedPost.objects.filter(pk__in=post_ids).update(
+        comments_count=_real_count(ArchivedComment, 'post'))
+
+
+def reconcile():
+    """Исправляет разошедшиеся счётчики, возвращает число исправленных."""
+    fixed = 0
+    drifted = AuthorStats.objects.annotate(**{
+        'real_' + name: _real_total(models, field, 'user')
+        for name, models, field in STATS_FIELDS
+    }).filter(reduce(operator.or_, [
+        ~Q(**{name: F('real_' + name)}) for name, *rest in STATS_FIELDS
+    ]))
+    for stats in drifted.iterator():
+        for name, *rest in STATS_FIELDS:
+            setattr(stats, name, getattr(stats, 'real_' + name))
+        stats.save(update_fields=[name for name, *rest in STATS_FIELDS])
+        fixed += 1
+
+    missing = User.objects.filter(stats__isnull=True).annotate(**{
+        name: _real_total(models, field)
+        for name, models, field in STATS_FIELDS
+    })
+    for user in missing.iterator():
+        AuthorStats.objects.create(user=user, **{
+            name: getattr(user, name) for name, *rest in STATS_FIELDS
+        })
+        fixed += 1
+
+    posts = Post.objects.annotate(
+        real_comments=_real_count(Comment, 'post')
+    ).exclude(comments_count=F('real_comments'))
+    for post in posts.only('pk').iterator():
+        Post.objects.filter(pk=post.pk).update(
+            comments_count=post.real_comments)
+        fixed += 1
+    return fixed
@@ -0,0 +1,117 @@
+"""Дайджест новых постов для подписчиков.
+
+Команда send_digest раз в DIGEST_INTERVAL_MINUTES открывает интервал
+(since, until] от конца прошлого дайджеста и обходит подписчиков авторов,
+писавших в этом интервале, порциями по DIGEST_BATCH_SIZE по возрастанию
+id. Каждая порция -- задача очереди core.jobs: она рендерит блок каждого
+поста один раз на всю порцию, собирает из блоков по одному письму на
+подписчика и отправляет письма одним соединением почтового бэкенда.
+Строка Digest (start) и задачи порций (schedule) пишутся в одной
+транзакции: интервал не считается разосланным без своих задач.
+
+Порция при повторе после ошибки отправляется целиком, поэтому часть
+писем может прийти дважды.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+
+from core import metrics
+from core.jobs import job
+from core.mail import deliver
+from .models import Digest, Follow, Post
+
+User = get_user_model()
+
+POSTS_MARKER = '[[posts]]'
+
+
+def window_posts(digest):
+    return Post.objects.filter(
+        pub_date__gt=digest.since, pub_date__lte=digest.until)
+
+
+def start(now=None, force=False):
+    """Открывает следующий интервал; None, если он ещё не прошёл."""
+    now = now or timezone.now()
+    interval = timedelta(minutes=settings.DIGEST_INTERVAL_MINUTES)
+    last = Digest.objects.first()
+    since = last.until if last else now - interval
+    if now - since < interval and not force:
+        return None
+    return Digest.objects.create(since=since, until=now)
+
+
+def follower_batches(digest, batch_size):
+    """id подписчиков авторов интервала порциями, без повторов."""
+    authors = window_posts(digest).values('author')
+    last = 0
+    while True:
+        batch = list(
+            Follow.objects.filter(author__in=authors, user_id__gt=last)
+            .order_by('user_id').values_list('user_id', flat=True)
+            .distinct()[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def schedule(digest, batch_size=None):
+    """Ставит порции дайджеста в очередь, возвращает число подписчиков."""
+    batch_size = batch_size or settings.DIGEST_BATCH_SIZE
+    followers = 0
+    for batch in follower_batches(digest, batch_size):
+        send_digest_batch.enqueue(digest.pk, batch)
+        followers += len(batch)
+    Digest.objects.filter(pk=digest.pk).update(followers=followers)
+    return followers
+
+
+def _message(email, head, blocks, tail):
+    limit = settings.DIGEST_MAX_POSTS
+    body = ''.join(blocks[:limit])
+    if len(blocks) > limit:
+        body += 'И ещё постов: {}\n'.format(len(blocks) - limit)
+    return EmailMessage(
+        'Новые посты ваших подписок: {}'.format(len(blocks)),
+        head + body + tail, to=[email])
+
+
+@job(priority=1)
+def send_digest_batch(digest_id, user_ids):
+    digest = Digest.objects.get(pk=digest_id)
+    recipients = dict(User.objects.filter(pk__in=user_ids, is_active=True)
+                      .exclude(email='').values_list('pk', 'email'))
+    follows = defaultdict(set)
+    for user_id, author_id in Follow.objects.filter(
+            user_id__in=list(recipients),
+            author__in=window_posts(digest).values('author')
+    ).values_list('user_id', 'author_id'):
+        follows[user_id].add(author_id)
+    if not follows:
+        return 0
+    posts = (window_posts(digest)
+             .filter(author_id__in=set().union(*follows.values()))
+             .select_related('author', 'group')
+             .order_by('-pub_date', '-pk'))
+    site_url = settings.DIGEST_SITE_URL
+    template = get_template('posts/email/digest_post.txt')
+    blocks = [(post.author_id,
+               template.render({'post': post, 'site_url': site_url}))
+              for post in posts]
+    head, tail = render_to_string('posts/email/digest.txt', {
+        'posts': POSTS_MARKER, 'site_url': site_url}).split(POSTS_MARKER)
+    messages = [
+        _message(recipients[user_id], head,
+                 [block for author_id, block in blocks
+                  if author_id in authors], tail)
+        for user_id, authors in follows.items()]
+    deliver(messages)
+    metrics.inc('digest_emails_total', len(messages))
+    return len(messages)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = ('Переносит посты старше POSTS_ARCHIVE_AFTER_DAYS с комментариями '
+            'в архивные таблицы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Возраст поста в днях; по умолчанию '
+                 'POSTS_ARCHIVE_AFTER_DAYS.')
+        parser.add_argument(
+            '--batch-size', type=int, default=archive.BATCH_SIZE,
+            help='Постов в одной транзакции.')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Пауза между порциями, секунды.')
+
+    def handle(self, *args, **options):
+        before = archive.cutoff(options['days'])
+        moved = 0
+        for batch in archive.archive_posts(
+                before, options['batch_size'], options['pause']):
+            moved += batch
+            if options['verbosity'] > 1:
+                self.stdout.write('Перенесено постов: {}'.format(moved))
+        self.stdout.write(self.style.SUCCESS(
+            'Перенесено в архив постов: {}'.format(moved)))
@@ -0,0 +1,112 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from core.cache_backend import temporary_caches
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Наполняет отдельную тестовую базу синтетическими данными и '
+            'замеряет представления posts. Результат -- JSON для '
+            'сравнения между релизами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--follow-shape', choices=benchmark.FOLLOW_SHAPES,
+                            default='popular')
+        parser.add_argument('--image-share', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждый сценарий.')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            choices=[scenario.name for scenario in benchmark.SCENARIOS],
+            help='Сценарий (можно несколько); по умолчанию все.')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом.')
+        parser.add_argument(
+            '--use-current-db', action='store_true',
+            help='Писать в текущую базу вместо временной тестовой.')
+        parser.add_argument('--output', help='Файл для JSON; иначе stdout.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['groups'] < 1 or (
+                options['posts'] < 1 or options['requests'] < 1):
+            raise CommandError(
+                'Нужны хотя бы 2 пользователя, группа, пост и запрос.')
+        work_dir = tempfile.mkdtemp()
+        old_name = None
+        if not options['use_current_db']:
+            # create_test_db возвращает имя тестовой базы, а не прежнее
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # синтетические страницы не должны попасть в кэш и метрики
+            # сайта; данные пишутся только в default, реплики их не видят
+            with override_settings(
+                    MEDIA_ROOT=os.path.join(work_dir, 'media'),
+                    CACHES=temporary_caches(work_dir),
+                    METRICS_DIR=os.path.join(work_dir, 'metrics'),
+                    DATABASE_REPLICAS=[]):
+                report = self.benchmark(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(data + '\n')
+        else:
+            self.stdout.write(data)
+
+    def benchmark(self, options):
+        dataset_options = {
+            name: options[name] for name in (
+                'users', 'groups', 'posts', 'comments', 'follows_per_user',
+                'follow_shape', 'image_share', 'seed')
+        }
+        self.stderr.write('Генерация данных...')
+        benchmark.generate(**dataset_options)
+        dataset = benchmark.load_dataset()
+        runner = benchmark.Runner(
+            'bench0', seed=options['seed'], cold=options['cold'])
+
+        scenarios = {}
+        for scenario in benchmark.SCENARIOS:
+            if options['scenarios'] and (
+                    scenario.name not in options['scenarios']):
+                continue
+            self.stderr.write(scenario.name + '...')
+            scenarios[scenario.name] = runner.run(
+                scenario, dataset, options['requests'], options['warmup'])
+        return {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': sys.platform,
+            },
+            'dataset': dataset_options,
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+            'cold_cache': options['cold'],
+            'scenarios': scenarios,
+        }
@@ -0,0 +1,76 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts.models import ArchivedComment, Comment, Group, Post
+from posts.timeline import timeline_posts
+from posts.utils import COUNT_COMMENTS, COUNT_POSTS, CursorPaginator
+
+User = get_user_model()
+
+FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+
+
+def view_querysets():
+    """Запросы, которые выполняют страницы приложения posts."""
+    author = User(pk=0)
+    group = Group(pk=0)
+    feeds = [
+        ('index', Post.objects.feed()),
+        ('group_posts', group.posts.feed()),
+        ('profile', author.posts.feed()),
+        ('profile archive', author.archived_posts.feed()),
+        ('follow_index', timeline_posts(author).feed()),
+    ]
+    cursor = (timezone.now(), 0)
+    for name, queryset in feeds:
+        paginator = CursorPaginator(queryset, COUNT_POSTS)
+        yield name, paginator.page_queryset()
+        yield name + ' ?after=', paginator.page_queryset(cursor)
+        yield name + ' ?before=', paginator.page_queryset(cursor, True)
+    yield 'post_detail', Post.objects.filter(pk=0)
+    comments = CursorPaginator(
+        Comment.objects.filter(post_id=0).select_related('author'),
+        COUNT_COMMENTS, field='created', descending=False)
+    yield 'post_detail comments', comments.page_queryset()
+    yield 'post_detail comments ?after=', comments.page_queryset(cursor)
+    archived = CursorPaginator(
+        ArchivedComment.objects.filter(post_id=0).select_related('author'),
+        COUNT_COMMENTS, field='created', descending=False)
+    yield 'post_detail archive comments', archived.page_queryset(cursor)
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет запросы лент через EXPLAIN QUERY PLAN и сообщает '
+            'о полных просмотрах таблиц.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Считать ошибкой и сортировку во временном B-дереве.')
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы всех запросов.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                'EXPLAIN QUERY PLAN поддерживается только для SQLite.')
+        problems = []
+        for name, queryset in view_querysets():
+            plan = queryset.explain()
+            found = ['полный просмотр ' + table
+                     for table in FULL_SCAN.findall(plan)]
+            if options['strict'] and TEMP_SORT.search(plan):
+                found.append('сортировка во временном B-дереве')
+            if options['verbose_plans'] or found:
+                self.stdout.write('{}:\n{}'.format(name, plan))
+            problems.extend('{}: {}'.format(name, item) for item in found)
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            'Полных просмотров таблиц не найдено.'))
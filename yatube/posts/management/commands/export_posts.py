@@ -0,0 +1,77 @@
+import gzip
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Group, Post)
+
+User = get_user_model()
+
+POST_FIELDS = ('id', 'text', 'pub_date', 'updated', 'author__username',
+               'group__slug', 'image')
+COMMENT_FIELDS = ('id', 'post_id', 'author__username', 'text', 'created')
+
+# (тип записи, queryset, поля) в порядке, в котором их ждёт import_posts;
+# архивные посты выгружаются как обычные, archive_posts снова их перенесёт
+EXPORTS = (
+    ('user', lambda: User.objects.all(),
+     ('username', 'first_name', 'last_name', 'email')),
+    ('group', lambda: Group.objects.all(),
+     ('slug', 'title', 'description')),
+    ('post', lambda: Post.objects.all(), POST_FIELDS),
+    ('post', lambda: ArchivedPost.objects.all(), POST_FIELDS),
+    ('comment', lambda: Comment.objects.filter(post__isnull=False),
+     COMMENT_FIELDS),
+    ('comment', lambda: ArchivedComment.objects.all(), COMMENT_FIELDS),
+    ('follow', lambda: Follow.objects.all(),
+     ('user__username', 'author__username')),
+)
+
+
+def open_output(path):
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, группы, посты, комментарии и '
+            'подписки в NDJSON (по объекту на строку).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output', nargs='?', default='-',
+            help='Файл (.gz сжимается) или - для stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        output = open_output(options['output'])
+        try:
+            for kind, queryset, fields in EXPORTS:
+                self.export(output, kind, queryset(), fields,
+                            options['chunk_size'])
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def export(self, output, kind, queryset, fields, chunk_size):
+        started = time.monotonic()
+        rows = 0
+        values = queryset.order_by('pk').values_list(*fields)
+        for row in values.iterator(chunk_size=chunk_size):
+            record = {'type': kind}
+            for field, value in zip(fields, row):
+                if hasattr(value, 'isoformat'):
+                    value = value.isoformat()
+                record[field.split('__')[0]] = value
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            rows += 1
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stderr.write('{}: {} строк, {:.0f} строк/с'.format(
+            kind, rows, rows / elapsed))
@@ -0,0 +1,221 @@
+import gzip
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from posts import counters, search
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Group, Post)
+from posts.utils import keep_dates
+
+User = get_user_model()
+
+
+def open_input(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON из export_posts пачками через bulk_create. '
+            'id постов и комментариев сохраняются; записи с уже занятыми '
+            'id и комментарии к ним пропускаются и перечисляются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл (.gz) или - для stdin.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--skip-rebuild', action='store_true',
+            help='Не пересчитывать счётчики, ленты и поисковый индекс.')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.batches = {kind: [] for kind in self.builders}
+        self.rows = dict.fromkeys(self.builders, 0)
+        self.skipped = {'post': [], 'comment': []}
+        # комментарии привязываются только к постам из этой загрузки
+        self.imported_posts = set()
+        self.started = time.monotonic()
+
+        source = open_input(options['input'])
+        try:
+            with keep_dates():
+                for number, line in enumerate(source, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        kind = record['type']
+                        batch = self.batches[kind]
+                    except (ValueError, KeyError) as error:
+                        raise CommandError(
+                            'Строка {}: {!r}'.format(number, error))
+                    if not batch:
+                        # записи, на которые ссылается новый тип, уже
+                        # должны лежать в базе
+                        self.flush_all(exclude=kind)
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        self.flush(kind)
+                self.flush_all()
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        self.reset_sequences()
+        if not options['skip_rebuild']:
+            self.rebuild()
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        total = sum(self.rows.values())
+        details = ', '.join(
+            '{}: {}'.format(*item) for item in self.rows.items())
+        self.stdout.write(self.style.SUCCESS(
+            'Загружено {} строк ({}), {:.0f} строк/с'.format(
+                total, details, total / elapsed)))
+        for kind, ids in self.skipped.items():
+            if ids:
+                self.stdout.write(self.style.WARNING(
+                    'Пропущено {}: {}, id: {}'.format(
+                        kind, len(ids), ', '.join(map(str, ids[:100])))))
+
+    def flush(self, kind):
+        records = self.batches[kind]
+        if not records:
+            return
+        with transaction.atomic():
+            loaded = self.builders[kind](self, records)
+        self.rows[kind] += len(records) if loaded is None else loaded
+        self.batches[kind] = []
+
+    def flush_all(self, exclude=None):
+        for kind in self.builders:
+            if kind != exclude:
+                self.flush(kind)
+
+    def resolve_users(self, usernames):
+        missing = set(usernames) - self.users.keys()
+        if missing:
+            User.objects.bulk_create(
+                [User(username=name, password='!') for name in missing],
+                ignore_conflicts=True)
+            self.users.update(User.objects.filter(
+                username__in=missing).values_list('username', 'pk'))
+
+    def load_users(self, records):
+        users = []
+        for record in records:
+            if record['username'] not in self.users:
+                users.append(User(
+                    username=record['username'],
+                    first_name=record.get('first_name', ''),
+                    last_name=record.get('last_name', ''),
+                    email=record.get('email', ''),
+                    password='!',
+                ))
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        self.resolve_users(record['username'] for record in records)
+
+    def load_groups(self, records):
+        Group.objects.bulk_create([
+            Group(slug=record['slug'], title=record['title'],
+                  description=record.get('description', ''))
+            for record in records if record['slug'] not in self.groups
+        ], ignore_conflicts=True)
+        self.groups.update(Group.objects.filter(
+            slug__in=[record['slug'] for record in records]
+        ).values_list('slug', 'pk'))
+
+    def split_taken(self, kind, records, *models):
+        """Откладывает записи, чей id уже занят в базе или в архиве."""
+        ids = [record['id'] for record in records]
+        taken = set()
+        for model in models:
+            taken.update(model.objects.filter(pk__in=ids)
+                         .values_list('pk', flat=True))
+        self.skipped[kind].extend(
+            record['id'] for record in records if record['id'] in taken)
+        return [record for record in records if record['id'] not in taken]
+
+    def load_posts(self, records):
+        records = self.split_taken('post', records, Post, ArchivedPost)
+        self.resolve_users(record['author'] for record in records)
+        Post.objects.bulk_create([
+            Post(
+                pk=record['id'],
+                text=record['text'],
+                pub_date=parse_datetime(record['pub_date']),
+                updated=parse_datetime(
+                    record.get('updated') or record['pub_date']),
+                author_id=self.users[record['author']],
+                group_id=self.groups.get(record.get('group')),
+                image=record.get('image') or '',
+            ) for record in records
+        ])
+        self.imported_posts.update(record['id'] for record in records)
+        return len(records)
+
+    def load_comments(self, records):
+        orphans = [record['id'] for record in records
+                   if record['post_id'] not in self.imported_posts]
+        self.skipped['comment'].extend(orphans)
+        records = self.split_taken(
+            'comment', [record for record in records
+                        if record['post_id'] in self.imported_posts],
+            Comment, ArchivedComment)
+        self.resolve_users(record['author'] for record in records)
+        Comment.objects.bulk_create([
+            Comment(
+                pk=record['id'],
+                post_id=record['post_id'],
+                author_id=self.users[record['author']],
+                text=record['text'],
+                created=parse_datetime(record['created']),
+            ) for record in records
+        ])
+        return len(records)
+
+    def load_follows(self, records):
+        self.resolve_users(
+            name for record in records
+            for name in (record['user'], record['author']))
+        Follow.objects.bulk_create([
+            Follow(user_id=self.users[record['user']],
+                   author_id=self.users[record['author']])
+            for record in records
+        ], ignore_conflicts=True)
+
+    builders = {
+        'user': load_users,
+        'group': load_groups,
+        'post': load_posts,
+        'comment': load_comments,
+        'follow': load_follows,
+    }
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Post, Comment])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def rebuild(self):
+        # bulk_create не шлёт сигналы: пересчитываем производные данные
+        self.stderr.write('Пересчёт счётчиков, лент и поискового индекса...')
+        counters.reconcile()
+        call_command('rebuild_timelines', stdout=self.stderr)
+        search.rebuild()
+        cache.clear()
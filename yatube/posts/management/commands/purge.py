@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import purge
+from posts.models import Group
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Удаляет автора, группу, старые комментарии или ненужные '
+            'картинки короткими транзакциями; прерванный запуск '
+            'продолжается с места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'target', choices=['user', 'group', 'comments', 'media'])
+        parser.add_argument(
+            'name', nargs='?',
+            help='Имя пользователя (user) или slug группы (group).')
+        parser.add_argument(
+            '--days', type=int,
+            help='comments: удалить комментарии старше стольких дней.')
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='media: не трогать файлы моложе стольких часов.')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Строк в транзакции; по умолчанию PURGE_BATCH_SIZE.')
+        parser.add_argument(
+            '--pause', type=float,
+            help='Пауза между транзакциями; по умолчанию PURGE_PAUSE.')
+
+    def handle(self, *args, **options):
+        target = options['target']
+        purge_options = {
+            'batch_size': options['batch_size'],
+            'pause': options['pause'],
+            'log': self.stdout.write if options['verbosity'] > 1 else None,
+        }
+        now = timezone.now()
+        if target == 'user':
+            deleted = purge.purge_user(
+                self.get(User, username=options['name']), **purge_options)
+        elif target == 'group':
+            deleted = purge.purge_group(
+                self.get(Group, slug=options['name']), **purge_options)
+        elif target == 'comments':
+            if options['days'] is None:
+                raise CommandError('Укажите --days.')
+            deleted = purge.purge_comments(
+                now - timedelta(days=options['days']), **purge_options)
+        else:
+            deleted = purge.purge_media(
+                now - timedelta(hours=options['grace_hours']),
+                **purge_options)
+        self.stdout.write(self.style.SUCCESS(
+            'Удалено: {}'.format(deleted)))
+
+    def get(self, model, **lookup):
+        try:
+            return model.objects.get(**lookup)
+        except model.DoesNotExist:
+            raise CommandError('{} не найден: {}'.format(
+                model._meta.verbose_name, *lookup.values()))
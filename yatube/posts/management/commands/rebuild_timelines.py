@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или обрезает материализованные ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пользователи; по умолчанию все, у кого есть подписки.')
+        parser.add_argument(
+            '--trim', action='store_true',
+            help='Только обрезать ленты до TIMELINE_MAX_LENGTH.')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(follower__isnull=False).distinct()
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        action = timeline.trim if options['trim'] else timeline.rebuild
+        done = 0
+        for user in users.iterator():
+            action(user)
+            done += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано лент: {}'.format(done)))
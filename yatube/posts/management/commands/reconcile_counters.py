@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, комментариев и подписок.'
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            'Исправлено счётчиков: {}'.format(fixed)))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import ArchivedPost, Post
+
+
+class Command(BaseCommand):
+    help = ('Ставит в очередь задач подготовку миниатюр для постов '
+            'с картинкой, у которых миниатюры ещё нет.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        scheduled = 0
+        for model in (Post, ArchivedPost):
+            last = 0
+            while True:
+                rows = list(model.objects.filter(
+                    pk__gt=last, thumbnail='').exclude(image='')
+                    .order_by('pk').values_list('pk', 'image')
+                    [:options['batch_size']])
+                if not rows:
+                    break
+                for pk, name in rows:
+                    thumbnails.render_thumbnails.enqueue(pk, name)
+                scheduled += len(rows)
+                last = rows[-1][0]
+        self.stdout.write(self.style.SUCCESS(
+            'Поставлено задач: {}'.format(scheduled)))
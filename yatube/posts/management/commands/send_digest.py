@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import digest
+
+
+class Command(BaseCommand):
+    help = ('Рассылает подписчикам дайджест постов, опубликованных после '
+            'прошлого дайджеста. Запускается раз в DIGEST_INTERVAL_MINUTES.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Подписчиков в одной задаче; по умолчанию '
+                 'DIGEST_BATCH_SIZE.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Не ждать окончания интервала.')
+
+    def handle(self, *args, **options):
+        # интервал считается разосланным, только если его задачи в очереди
+        with transaction.atomic():
+            current = digest.start(force=options['force'])
+            if current is None:
+                self.stdout.write('Интервал дайджеста ещё не прошёл.')
+                return
+            followers = digest.schedule(current, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Дайджест {}: подписчиков {}'.format(current, followers)))
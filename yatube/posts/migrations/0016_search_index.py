@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:07
+
+from django.db import migrations
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+    "USING fts5(text, tokenize='unicode61')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_comment_fts "
+    "USING fts5(text, post_id UNINDEXED, tokenize='unicode61')",
+    'INSERT INTO posts_post_fts(rowid, text) SELECT id, text FROM posts_post',
+    'INSERT INTO posts_comment_fts(rowid, text, post_id) '
+    'SELECT id, text, post_id FROM posts_comment',
+)
+DROP_SQL = (
+    'DROP TABLE IF EXISTS posts_post_fts',
+    'DROP TABLE IF EXISTS posts_comment_fts',
+)
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SQL), _run(DROP_SQL)),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Задача')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='Этап')),
+                ('position', models.CharField(blank=True, max_length=255, verbose_name='Позиция')),
+                ('deleted', models.BigIntegerField(default=0, verbose_name='Удалено')),
+                ('started', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Последняя порция')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка удаления',
+                'verbose_name_plural': 'Контрольные точки удаления',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_purgecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Digest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(verbose_name='Посты после')),
+                ('until', models.DateTimeField(unique=True, verbose_name='Посты до')),
+                ('followers', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Дайджест',
+                'verbose_name_plural': 'Дайджесты',
+                'ordering': ('-until',),
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 
+from . import thumbnails
+
 User = get_user_model()
 
 TEXT_LENGHT = 15
@@ -19,6 +21,87 @@ class Group(models.Model):
         verbose_name_plural = 'Группы'
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        return self.select_related('author', 'group')
+
+
+class ArchiveUnion:
+    """Посты основной и архивной таблиц как одна выборка.
+
+    Фильтры применяются к каждой таблице, строки сливаются по убыванию
+    (pub_date, pk). Страница берёт из каждой таблицы не больше строк,
+    чем в ней помещается, а get и in_bulk идут в архив только за тем,
+    чего нет в основной таблице.
+    """
+    ordering = ('-pub_date', '-pk')
+    ordered = True
+
+    def __init__(self, *parts):
+        self.parts = parts
+        self.model = parts[0].model
+
+    def _chain(self, method, *args, **kwargs):
+        return type(self)(*[getattr(part, method)(*args, **kwargs)
+                            for part in self.parts])
+
+    def all(self):
+        return self._chain('all')
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def select_related(self, *fields):
+        return self._chain('select_related', *fields)
+
+    def only(self, *fields):
+        return self._chain('only', *fields)
+
+    def feed(self):
+        return self._chain('feed')
+
+    def get(self, *args, **kwargs):
+        for part in self.parts:
+            try:
+                return part.get(*args, **kwargs)
+            except part.model.DoesNotExist:
+                pass
+        raise self.model.DoesNotExist(
+            '{} matching query does not exist.'.format(
+                self.model._meta.object_name))
+
+    def in_bulk(self, id_list):
+        found = {}
+        for part in self.parts:
+            missing = [pk for pk in id_list if pk not in found]
+            if not missing:
+                break
+            found.update(part.in_bulk(missing))
+        return found
+
+    def count(self):
+        return sum(part.count() for part in self.parts)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        rows = [row for part in self.parts
+                for row in part.order_by(*self.ordering)[:index.stop]]
+        rows.sort(key=lambda post: (post.pub_date, post.pk), reverse=True)
+        return rows[index]
+
+
+class WithArchiveManager(models.Manager):
+    """Post.with_archive: посты вместе с перенесёнными в архив."""
+
+    def get_queryset(self):
+        return ArchiveUnion(
+            self.model._default_manager.all(), ArchivedPost.objects.all())
+
+    def feed(self):
+        return self.get_queryset().feed()
+
+
 class Post(models.Model):
     text = models.TextField(
         verbose_name='Текст поста',
@@ -29,6 +112,10 @@ class Post(models.Model):
         help_text='Дата публикации поста',
         auto_now_add=True
     )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -51,15 +138,49 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    thumbnail = models.CharField(
+        'Миниатюра',
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
+    with_archive = WithArchiveManager()
+
+    is_archived = False
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:TEXT_LENGHT]
 
+    def save(self, *args, **kwargs):
+        # счётчики и задачи, которые меняют и ставят сигналы,
+        # фиксируются вместе с постом
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @property
+    def thumbnail_url(self):
+        return thumbnails.url(self)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -91,6 +212,95 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [models.Index(
+            fields=['post', 'created'], name='comment_post_created_idx')]
+
+    def save(self, *args, **kwargs):
+        # счётчик комментариев поста меняется вместе с комментарием
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class ArchivedPost(models.Model):
+    """Пост старше POSTS_ARCHIVE_AFTER_DAYS, перенесённый из Post.
+
+    id сохраняется, поэтому адреса и записи поискового индекса остаются
+    прежними. Архивные посты только читаются.
+    """
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField(verbose_name='Текст поста')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+    updated = models.DateTimeField(verbose_name='Дата изменения')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_posts',
+        verbose_name='Автор'
+    )
+    group = models.ForeignKey(
+        Group,
+        verbose_name='Группа',
+        on_delete=models.SET_NULL,
+        related_name='archived_posts',
+        blank=True,
+        null=True
+    )
+    image = models.ImageField(
+        'Картинка',
+        upload_to='posts/',
+        blank=True
+    )
+    thumbnail = models.CharField(
+        'Миниатюра',
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        default=0
+    )
+
+    objects = PostQuerySet.as_manager()
+
+    is_archived = True
+
+    thumbnail_url = Post.thumbnail_url
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Архивный пост'
+        verbose_name_plural = 'Архивные посты'
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='archived_author_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.text[:TEXT_LENGHT]
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(
+        ArchivedPost,
+        on_delete=models.CASCADE,
+        related_name='comments'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_comments',
+        verbose_name='Автор комментария'
+    )
+    text = models.TextField(verbose_name='Текст комментария')
+    created = models.DateTimeField(verbose_name='Дата комментария')
+
+    class Meta:
+        verbose_name = 'Архивный комментарий'
+        verbose_name_plural = 'Архивные комментарии'
+        indexes = [models.Index(
+            fields=['post', 'created'], name='archived_comment_post_idx')]
 
 
 class Follow(models.Model):
@@ -108,3 +318,130 @@ class Follow(models.Model):
         verbose_name_plural = 'Лента авторов'
         constraints = [models.UniqueConstraint(
             fields=['user', 'author'], name='unique_visitors')]
+        indexes = [models.Index(
+            fields=['author', 'user'], name='follow_author_user_idx')]
+
+    def save(self, *args, **kwargs):
+        # счётчики и задача заполнения ленты фиксируются вместе с подпиской
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class AuthorStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'post'], name='unique_timeline_entry')]
+        indexes = [models.Index(
+            fields=['user', '-pub_date'], name='timeline_user_date_idx')]
+
+
+class PurgeCheckpoint(models.Model):
+    """Состояние задачи удаления: прерванная задача продолжится с него."""
+    name = models.CharField(
+        verbose_name='Задача',
+        max_length=200,
+        unique=True
+    )
+    stage = models.CharField(
+        verbose_name='Этап',
+        max_length=50,
+        blank=True
+    )
+    position = models.CharField(
+        verbose_name='Позиция',
+        max_length=255,
+        blank=True
+    )
+    deleted = models.BigIntegerField(
+        verbose_name='Удалено',
+        default=0
+    )
+    started = models.DateTimeField(
+        verbose_name='Начало',
+        auto_now_add=True
+    )
+    updated = models.DateTimeField(
+        verbose_name='Последняя порция',
+        auto_now=True
+    )
+    finished = models.DateTimeField(
+        verbose_name='Завершена',
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        verbose_name = 'Контрольная точка удаления'
+        verbose_name_plural = 'Контрольные точки удаления'
+
+    def __str__(self):
+        return self.name
+
+
+class Digest(models.Model):
+    """Рассылка дайджеста за интервал (since, until]."""
+    since = models.DateTimeField(
+        verbose_name='Посты после'
+    )
+    until = models.DateTimeField(
+        verbose_name='Посты до',
+        unique=True
+    )
+    followers = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0
+    )
+    created = models.DateTimeField(
+        verbose_name='Создан',
+        auto_now_add=True
+    )
+
+    class Meta:
+        verbose_name = 'Дайджест'
+        verbose_name_plural = 'Дайджесты'
+        ordering = ('-until',)
+
+    def __str__(self):
+        return '{:%Y-%m-%d %H:%M} - {:%Y-%m-%d %H:%M}'.format(
+            self.since, self.until)
@@ -0,0 +1,198 @@
+"""Удаление больших объёмов данных короткими порциями.
+
+Каскадное удаление автора или группы одной транзакцией держит
+блокировку записи SQLite секундами. Здесь то же удаление разбито на
+этапы (ленты, комментарии, посты, архив, подписки), а этап -- на порции
+по PURGE_BATCH_SIZE строк по возрастанию ключа, каждая в своей
+транзакции и с паузой PURGE_PAUSE между ними.
+
+Прогресс хранится в PurgeCheckpoint и фиксируется вместе с порцией,
+поэтому прерванная задача при повторном запуске продолжает с места
+остановки. Число удалённых строк и порций видно в /metrics.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from sorl.thumbnail import delete as delete_with_thumbnails
+
+from core import metrics
+from . import cache, counters, search
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Post,
+                     PurgeCheckpoint, TimelineEntry)
+
+User = get_user_model()
+
+MEDIA_DIR = 'posts'
+
+
+def _delete(queryset):
+    """Обычное удаление: каскады и сигналы, но в пределах порции."""
+    return queryset.delete()[0]
+
+
+def _delete_archived_comments(queryset):
+    rows = list(queryset.values_list('pk', 'post_id'))
+    deleted = queryset._raw_delete(queryset.db)
+    search.remove_comments([pk for pk, post_id in rows])
+    counters.recount_archived_comments({post_id for pk, post_id in rows})
+    return deleted
+
+
+def _delete_archived_posts(queryset):
+    ids = list(queryset.values_list('pk', flat=True))
+    deleted = queryset._raw_delete(queryset.db)
+    search.remove_posts(ids)
+    return deleted
+
+
+def _ungroup(queryset):
+    rows = list(queryset.values_list('pk', 'author__username'))
+    updated = queryset.update(group=None)
+    # группа видна в профилях авторов и на страницах постов
+    cache.bump(*{cache.profile_feed(username) for pk, username in rows},
+               *[cache.post_feed(pk) for pk, username in rows])
+    return updated
+
+
+class Purge:
+    """Задача удаления с контрольной точкой."""
+
+    def __init__(self, name, batch_size=None, pause=None, log=None):
+        self.name = name
+        self.batch_size = batch_size or settings.PURGE_BATCH_SIZE
+        self.pause = settings.PURGE_PAUSE if pause is None else pause
+        self.log = log
+        self.checkpoint = PurgeCheckpoint.objects.get_or_create(
+            name=name)[0]
+        if self.checkpoint.finished:
+            # задача уже выполнялась: начинаем заново
+            PurgeCheckpoint.objects.filter(pk=self.checkpoint.pk).update(
+                stage='', position='', deleted=0, finished=None,
+                started=timezone.now())
+            self.checkpoint.refresh_from_db()
+
+    def _save(self, **fields):
+        for field, value in fields.items():
+            setattr(self.checkpoint, field, value)
+        self.checkpoint.save(update_fields=[*fields, 'updated'])
+
+    def advance(self, stage, position, deleted):
+        """Запоминает порцию; вызывается в её транзакции."""
+        self._save(stage=stage, position=position,
+                   deleted=self.checkpoint.deleted + deleted)
+
+    def report(self, kind, deleted):
+        """Метрики и пауза после зафиксированной порции."""
+        metrics.inc('purge_deleted_total', deleted, kind=kind)
+        metrics.inc('purge_batches_total', kind=kind)
+        if self.log:
+            self.log('{}: {} {}, всего {}'.format(
+                self.name, self.checkpoint.stage, deleted,
+                self.checkpoint.deleted))
+        if self.pause:
+            time.sleep(self.pause)
+
+    def run_stage(self, stage, queryset, delete, kind):
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.order_by('pk')
+                           .values_list('pk', flat=True)[:self.batch_size])
+                if not ids:
+                    return
+                deleted = delete(queryset.model.objects.filter(pk__in=ids))
+                self.advance(stage, str(ids[-1]), deleted)
+            self.report(kind, deleted)
+
+    def run(self, stages, kind):
+        """stages -- список (этап, queryset, функция удаления порции)."""
+        for stage, queryset, delete in stages:
+            self.run_stage(stage, queryset, delete, kind)
+        self._save(stage='', position='', finished=timezone.now())
+        metrics.flush()
+        return self.checkpoint.deleted
+
+
+def purge_user(user, **options):
+    """Удаляет автора со всем содержимым, затем саму запись."""
+    if user.is_active:
+        # новых постов и комментариев во время удаления не появится
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+    deleted = Purge('user:{}'.format(user.pk), **options).run([
+        ('timeline', TimelineEntry.objects.filter(user=user), _delete),
+        ('post timeline', TimelineEntry.objects.filter(post__author=user),
+         _delete),
+        ('comments', Comment.objects.filter(author=user), _delete),
+        ('post comments', Comment.objects.filter(post__author=user),
+         _delete),
+        ('posts', Post.objects.filter(author=user), _delete),
+        ('archived comments', ArchivedComment.objects.filter(
+            Q(author=user) | Q(post__author=user)),
+         _delete_archived_comments),
+        ('archived posts', ArchivedPost.objects.filter(author=user),
+         _delete_archived_posts),
+        ('follows', Follow.objects.filter(Q(user=user) | Q(author=user)),
+         _delete),
+    ], kind='user')
+    # осталось несколько строк, например счётчики автора
+    user.delete()
+    return deleted
+
+
+def purge_group(group, **options):
+    """Отвязывает посты от группы порциями и удаляет группу."""
+    deleted = Purge('group:{}'.format(group.pk), **options).run([
+        ('posts', Post.objects.filter(group=group), _ungroup),
+        ('archived posts', ArchivedPost.objects.filter(group=group),
+         _ungroup),
+    ], kind='group')
+    group.delete()
+    return deleted
+
+
+def purge_comments(before, **options):
+    """Удаляет комментарии, оставленные раньше before."""
+    return Purge('comments', **options).run([
+        ('comments', Comment.objects.filter(created__lt=before), _delete),
+        ('archived comments',
+         ArchivedComment.objects.filter(created__lt=before),
+         _delete_archived_comments),
+    ], kind='comments')
+
+
+def _orphans(names, grace):
+    names = ['{}/{}'.format(MEDIA_DIR, name) for name in names]
+    used = set(Post.objects.filter(image__in=names)
+               .values_list('image', flat=True))
+    used.update(ArchivedPost.objects.filter(image__in=names)
+                .values_list('image', flat=True))
+    return [name for name in names if name not in used
+            and default_storage.get_modified_time(name) < grace]
+
+
+def purge_media(grace, **options):
+    """Удаляет картинки постов, на которые не ссылается ни один пост.
+
+    Файлы новее grace не трогаются: пост с ними может ещё сохраняться.
+    Позиция -- последнее просмотренное имя файла.
+    """
+    purge = Purge('media', **options)
+    if not default_storage.exists(MEDIA_DIR):
+        return purge.run([], kind='media')
+    files = sorted(default_storage.listdir(MEDIA_DIR)[1])
+    position = purge.checkpoint.position
+    files = [name for name in files if name > position]
+    for start in range(0, len(files), purge.batch_size):
+        chunk = files[start:start + purge.batch_size]
+        orphans = _orphans(chunk, grace)
+        for name in orphans:
+            # вместе с миниатюрами и их записями sorl
+            delete_with_thumbnails(name)
+        purge.advance('files', chunk[-1], len(orphans))
+        purge.report('media', len(orphans))
+    return purge.run([], kind='media')
@@ -0,0 +1,178 @@
+"""Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+
+Тексты лежат в виртуальных таблицах posts_post_fts и posts_comment_fts
+с rowid, равным id исходной записи, и обновляются сигналами. На других
+СУБД поиск откатывается к icontains.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Post
+
+TOKENS = re.compile(r'"([^"]*)"|(\S+)')
+WORDS = re.compile(r'\w+')
+# совпадение в комментарии весит меньше совпадения в тексте поста
+COMMENT_WEIGHT = 0.5
+
+FILL_SQL = (
+    'DELETE FROM posts_post_fts',
+    'DELETE FROM posts_comment_fts',
+    'INSERT INTO posts_post_fts(rowid, text) SELECT id, text FROM posts_post',
+    'INSERT INTO posts_comment_fts(rowid, text, post_id) '
+    'SELECT id, text, post_id FROM posts_comment',
+    # архивные посты сохраняют id, поэтому ищутся вместе с основными
+    'INSERT INTO posts_post_fts(rowid, text) '
+    'SELECT id, text FROM posts_archivedpost',
+    'INSERT INTO posts_comment_fts(rowid, text, post_id) '
+    'SELECT id, text, post_id FROM posts_archivedcomment',
+)
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def build_match(query):
+    """Переводит запрос пользователя в безопасное выражение MATCH.
+
+    "фраза в кавычках" ищется целиком, слово* -- по префиксу,
+    остальные слова должны встретиться все.
+    """
+    terms = []
+    for phrase, word in TOKENS.findall(query):
+        if phrase:
+            words = WORDS.findall(phrase)
+            if words:
+                terms.append('"{}"'.format(' '.join(words)))
+            continue
+        words = WORDS.findall(word)
+        terms.extend('"{}"'.format(item) for item in words)
+        if words and word.endswith('*'):
+            terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _execute(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def index_post(post):
+    if enabled():
+        _execute('DELETE FROM posts_post_fts WHERE rowid = %s', [post.pk])
+        _execute('INSERT INTO posts_post_fts(rowid, text) VALUES (%s, %s)',
+                 [post.pk, post.text])
+
+
+def remove_post(post):
+    if enabled():
+        _execute('DELETE FROM posts_post_fts WHERE rowid = %s', [post.pk])
+
+
+def remove_posts(post_ids):
+    if enabled() and post_ids:
+        _execute('DELETE FROM posts_post_fts WHERE rowid IN ({})'.format(
+            ', '.join(['%s'] * len(post_ids))), post_ids)
+
+
+def index_comment(comment):
+    if enabled():
+        _execute('DELETE FROM posts_comment_fts WHERE rowid = %s',
+                 [comment.pk])
+        _execute('INSERT INTO posts_comment_fts(rowid, text, post_id) '
+                 'VALUES (%s, %s, %s)',
+                 [comment.pk, comment.text, comment.post_id])
+
+
+def remove_comment(comment):
+    if enabled():
+        _execute('DELETE FROM posts_comment_fts WHERE rowid = %s',
+                 [comment.pk])
+
+
+def remove_comments(comment_ids):
+    if enabled() and comment_ids:
+        _execute('DELETE FROM posts_comment_fts WHERE rowid IN ({})'.format(
+            ', '.join(['%s'] * len(comment_ids))), comment_ids)
+
+
+def rebuild():
+    if not enabled():
+        return
+    for sql in FILL_SQL:
+        _execute(sql)
+
+
+def search_post_ids(query, limit=None):
+    """id постов по убыванию релевантности."""
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    match = build_match(query)
+    if not match:
+        return []
+    if not enabled():
+        return list(Post.objects.filter(text__icontains=query)
+                    .values_list('pk', flat=True)[:limit])
+    rows = _execute(
+        'SELECT post_id FROM ('
+        ' SELECT rowid AS post_id, bm25(posts_post_fts) AS score'
+        ' FROM posts_post_fts WHERE posts_post_fts MATCH %s'
+        ' UNION ALL'
+        ' SELECT post_id, bm25(posts_comment_fts) * %s AS score'
+        ' FROM posts_comment_fts WHERE posts_comment_fts MATCH %s'
+        ') GROUP BY post_id ORDER BY MIN(score) LIMIT %s',
+        [match, COMMENT_WEIGHT, match, limit])
+    return [row[0] for row in rows]
+
+
+def search_comment_ids(query, limit=None):
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    match = build_match(query)
+    if not match:
+        return []
+    if not enabled():
+        return list(Comment.objects.filter(text__icontains=query)
+                    .values_list('pk', flat=True)[:limit])
+    rows = _execute(
+        'SELECT rowid FROM posts_comment_fts WHERE posts_comment_fts '
+        'MATCH %s ORDER BY rank LIMIT %s', [match, limit])
+    return [row[0] for row in rows]
+
+
+class _MatchingIds(RawSQL):
+    """Подзапрос для pk__in: скобки вокруг него ставит сам lookup."""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def matching_post_ids(query):
+    """Подзапрос id всех постов под query для фильтра pk__in.
+
+    Без ранжирования и без предела SEARCH_MAX_RESULTS: так ищет админка,
+    где число найденного должно быть настоящим.
+    """
+    match = build_match(query)
+    if not match:
+        return Post.objects.none().values('pk')
+    if not enabled():
+        return Post.objects.filter(text__icontains=query).values('pk')
+    return _MatchingIds(
+        'SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s'
+        ' UNION SELECT post_id FROM posts_comment_fts'
+        ' WHERE posts_comment_fts MATCH %s', [match, match])
+
+
+def matching_comment_ids(query):
+    """Подзапрос id всех комментариев под query для фильтра pk__in."""
+    match = build_match(query)
+    if not match:
+        return Comment.objects.none().values('pk')
+    if not enabled():
+        return Comment.objects.filter(text__icontains=query).values('pk')
+    return _MatchingIds(
+        'SELECT rowid FROM posts_comment_fts WHERE posts_comment_fts'
+        ' MATCH %s', [match])
@@ -0,0 +1,163 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import cache, counters, search, timeline
+from .models import ArchivedPost, AuthorStats, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, raw=False, **kwargs):
+    instance._previous_username = None
+    if instance.pk and not raw:
+        instance._previous_username = (
+            User.objects.filter(pk=instance.pk)
+            .values_list('username', flat=True).first())
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if raw:
+        return
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+    elif update_fields != frozenset(['last_login']):
+        # имя автора видно в профиле, на страницах его постов и в
+        # карточках его постов на главной и в группах
+        feeds = [cache.profile_feed(instance.username)]
+        previous = getattr(instance, '_previous_username', None)
+        if previous and previous != instance.username:
+            feeds.append(cache.profile_feed(previous))
+        if Post.objects.filter(author=instance).exists():
+            slugs = (Group.objects.filter(posts__author=instance)
+                     .values_list('slug', flat=True).distinct())
+            feeds.append(cache.index_feed())
+            feeds.extend(cache.group_feed(slug) for slug in slugs)
+        cache.bump(*feeds)
+
+
+def _post_feeds(post, *group_slugs):
+    feeds = [
+        cache.index_feed(),
+        cache.profile_feed(post.author.username),
+        cache.post_feed(post.pk),
+    ]
+    if post.group_id:
+        feeds.append(cache.group_feed(post.group.slug))
+    feeds.extend(cache.group_feed(slug) for slug in group_slugs if slug)
+    return feeds
+
+
+def _bump_post_feeds(post_id):
+    row = (Post.objects.filter(pk=post_id)
+           .values_list('author__username', 'group__slug').first())
+    if row is not None:
+        username, slug = row
+        cache.bump(cache.index_feed(), cache.profile_feed(username),
+                   cache.post_feed(post_id),
+                   *([cache.group_feed(slug)] if slug else []))
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, raw=False, **kwargs):
+    instance._previous_group_slug = None
+    if instance.pk and not raw:
+        instance._previous_group_slug = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group__slug', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.bump_stats(instance.author_id, 'posts_count', 1)
+        timeline.fan_out_post.enqueue(instance.pk)
+    search.index_post(instance)
+    cache.bump(*_post_feeds(
+        instance, getattr(instance, '_previous_group_slug', None)))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_stats(instance.author_id, 'posts_count', -1)
+    search.remove_post(instance)
+    cache.bump(*_post_feeds(instance))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+        _bump_post_feeds(instance.post_id)
+    else:
+        # текст комментария виден только на странице поста
+        cache.bump(cache.post_feed(instance.post_id))
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+    search.remove_comment(instance)
+    _bump_post_feeds(instance.post_id)
+
+
+def _group_profile_feeds(group):
+    """Профили авторов группы: в их карточках видно название группы."""
+    usernames = set()
+    for model in (Post, ArchivedPost):
+        usernames.update(model.objects.filter(group=group).values_list(
+            'author__username', flat=True).distinct())
+    return [cache.profile_feed(username) for username in usernames]
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump(cache.index_feed(), cache.group_feed(instance.slug),
+                   *_group_profile_feeds(instance))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # после удаления посты уже не ссылаются на группу
+    instance._profile_feeds = _group_profile_feeds(instance)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    cache.bump(cache.index_feed(), cache.group_feed(instance.slug),
+               *getattr(instance, '_profile_feeds', []))
+
+
+def _bump_follow_profiles(follow):
+    usernames = User.objects.filter(
+        pk__in=[follow.user_id, follow.author_id]).values_list(
+        'username', flat=True)
+    cache.bump(*[cache.profile_feed(username) for username in usernames])
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_stats(instance.author_id, 'followers_count', 1)
+        counters.bump_stats(instance.user_id, 'following_count', 1)
+        timeline.backfill_follow.enqueue(
+            instance.user_id, instance.author_id)
+        _bump_follow_profiles(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump_stats(instance.author_id, 'followers_count', -1)
+    counters.bump_stats(instance.user_id, 'following_count', -1)
+    timeline.remove_author(instance.user_id, instance.author_id)
+    _bump_follow_profiles(instance)
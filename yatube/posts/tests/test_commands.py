@@ -0,0 +1,308 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from posts import purge
+from posts.counters import reconcile
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Digest,
+                          Follow, Group, Post, PurgeCheckpoint)
+
+User = get_user_model()
+
+
+class ExplainQueriesTest(TestCase):
+    def test_no_full_scans(self):
+        """запросы лент используют индексы"""
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('Полных просмотров таблиц не найдено', out.getvalue())
+
+
+class ExportImportTest(TestCase):
+    def test_round_trip(self):
+        """выгрузка и загрузка сохраняют посты, комментарии и подписки"""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(
+            title='Группа', slug='group', description='Описание')
+        post = Post.objects.create(
+            text='Текст поста', author=author, group=group)
+        Comment.objects.create(post=post, author=reader, text='Комментарий')
+        Follow.objects.create(user=reader, author=author)
+        pub_date = Post.objects.get(pk=post.pk).pub_date
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.ndjson.gz')
+            call_command('export_posts', path, stderr=StringIO())
+            User.objects.all().delete()
+            Group.objects.all().delete()
+            call_command('import_posts', path, batch_size=1,
+                         stdout=StringIO(), stderr=StringIO())
+
+        imported = Post.objects.get(pk=post.pk)
+        self.assertEqual(imported.text, 'Текст поста')
+        self.assertEqual(imported.pub_date, pub_date)
+        self.assertEqual(imported.author.username, 'author')
+        self.assertEqual(imported.group.slug, 'group')
+        self.assertEqual(imported.comments_count, 1)
+        self.assertEqual(imported.author.stats.followers_count, 1)
+        reader = User.objects.get(username='reader')
+        self.assertFalse(reader.has_usable_password())
+        self.assertTrue(reader.timeline.filter(post=imported).exists())
+        new_post = Post.objects.create(text='Новый', author=reader)
+        self.assertGreater(new_post.pk, post.pk)
+
+    def test_taken_ids_are_reported(self):
+        """пост с занятым id и его комментарии не загружаются"""
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(text='Из выгрузки', author=author)
+        Comment.objects.create(post=post, author=author, text='Ответ')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.ndjson')
+            call_command('export_posts', path, stderr=StringIO())
+            Post.objects.all().delete()
+            other = Post.objects.create(
+                pk=post.pk, text='Чужой пост', author=author)
+            out = StringIO()
+            call_command('import_posts', path, stdout=out, stderr=StringIO())
+
+        self.assertEqual(Post.objects.get(pk=post.pk).text, 'Чужой пост')
+        self.assertFalse(other.comments.exists())
+        self.assertIn('Пропущено post: 1, id: {}'.format(post.pk),
+                      out.getvalue())
+        self.assertIn('Пропущено comment: 1', out.getvalue())
+
+
+class BenchmarkTest(TestCase):
+    def test_report(self):
+        """отчёт содержит все сценарии без ошибок сервера"""
+        out = StringIO()
+        call_command('benchmark', use_current_db=True, users=5, groups=2,
+                     posts=30, comments=20, follows_per_user=2,
+                     image_share=0, requests=3, warmup=0,
+                     stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'add_comment'})
+        for name, result in report['scenarios'].items():
+            with self.subTest(scenario=name):
+                self.assertEqual(sum(result['statuses'].values()), 3)
+                self.assertTrue(all(
+                    int(status) < 400 for status in result['statuses']))
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(Post.objects.count(), 33)
+
+    def test_temporary_db_and_cache(self):
+        """замер во временной базе не трогает кэш и базу сайта"""
+        creation = connection.creation
+        name = connection.settings_dict['NAME']
+        self.addCleanup(connection.settings_dict.__setitem__, 'NAME', name)
+        cache.set('site-page', 'живая страница')
+
+        def destroy_test_db(old_database_name, **kwargs):
+            # как настоящий: возвращает базе переданное имя
+            connection.settings_dict['NAME'] = old_database_name
+
+        # замер идёт в базе тестов, create_test_db лишь называет новую
+        with mock.patch.object(creation, 'create_test_db',
+                               return_value='benchmark-test-db'), \
+                mock.patch.object(creation, 'destroy_test_db',
+                                  side_effect=destroy_test_db):
+            call_command('benchmark', users=2, groups=1, posts=3,
+                         comments=0, follows_per_user=1, image_share=0,
+                         requests=2, warmup=0, scenarios=['index'],
+                         stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(connection.settings_dict['NAME'], name)
+        self.assertEqual(cache.get('site-page'), 'живая страница')
+
+    @override_settings(DATABASE_REPLICAS=['replica-not-configured'])
+    def test_replicas_disabled(self):
+        """замеры читают из базы с данными, а не с реплик"""
+        out = StringIO()
+        call_command('benchmark', use_current_db=True, users=2, groups=1,
+                     posts=3, comments=0, follows_per_user=1,
+                     image_share=0, requests=2, warmup=0,
+                     scenarios=['follow_index'], stdout=out,
+                     stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['scenarios']['follow_index']['statuses'],
+                         {'200': 2})
+
+
+class ArchivePostsTest(TestCase):
+    def test_moves_old_posts_in_batches(self):
+        """старые посты переносятся порциями, счётчики и ленты в порядке"""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        old = [Post.objects.create(text='Старый', author=author)
+               for _ in range(3)]
+        Post.objects.filter(pk__in=[post.pk for post in old]).update(
+            pub_date=timezone.now() - timedelta(days=30))
+        Comment.objects.create(post=old[0], author=reader, text='Ответ')
+        fresh = Post.objects.create(text='Новый', author=author)
+
+        out = StringIO()
+        call_command('archive_posts', days=7, batch_size=2, verbosity=2,
+                     stdout=out)
+
+        self.assertIn('Перенесено постов: 2', out.getvalue())
+        self.assertIn('Перенесено в архив постов: 3', out.getvalue())
+        self.assertEqual(list(Post.objects.all()), [fresh])
+        self.assertEqual(ArchivedPost.objects.count(), 3)
+        self.assertEqual(ArchivedComment.objects.get().post_id, old[0].pk)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(list(reader.timeline.values_list('post', flat=True)),
+                         [fresh.pk])
+        self.assertEqual(reconcile(), 0)
+        author.stats.refresh_from_db()
+        self.assertEqual(author.stats.posts_count, 4)
+
+
+class PurgeTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.posts = [
+            Post.objects.create(text='Пост {}'.format(index),
+                                author=self.author, group=self.group)
+            for index in range(3)
+        ]
+        self.reader_post = Post.objects.create(
+            text='Пост читателя', author=self.reader)
+        Comment.objects.create(
+            post=self.posts[0], author=self.reader, text='Ответ')
+        Comment.objects.create(
+            post=self.reader_post, author=self.author, text='Ответ автора')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.author, author=self.reader)
+
+    def purge(self, *args, **options):
+        call_command('purge', *args, batch_size=1, pause=0,
+                     stdout=StringIO(), **options)
+
+    def test_user(self):
+        """автор удаляется порциями вместе со всем, что с ним связано"""
+        self.purge('user', 'author')
+        self.assertFalse(User.objects.filter(username='author').exists())
+        self.assertEqual(list(Post.objects.all()), [self.reader_post])
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(
+            Post.objects.get(pk=self.reader_post.pk).comments_count, 0)
+        self.assertEqual(reconcile(), 0)
+        checkpoint = PurgeCheckpoint.objects.get(
+            name='user:{}'.format(self.author.pk))
+        self.assertIsNotNone(checkpoint.finished)
+        self.assertGreater(checkpoint.deleted, 3)
+
+    def test_resume_after_interruption(self):
+        """прерванное удаление продолжается с контрольной точки"""
+        with mock.patch.object(purge.Purge, 'report',
+                               side_effect=[None, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                self.purge('user', 'author')
+        checkpoint = PurgeCheckpoint.objects.get()
+        self.assertEqual(checkpoint.deleted, 2)
+        self.assertIsNone(checkpoint.finished)
+        self.assertFalse(User.objects.get(username='author').is_active)
+
+        self.purge('user', 'author')
+        checkpoint.refresh_from_db()
+        self.assertIsNotNone(checkpoint.finished)
+        self.assertFalse(User.objects.filter(username='author').exists())
+
+    def test_group(self):
+        """посты группы отвязываются порциями, затем группа удаляется"""
+        self.purge('group', 'group')
+        self.assertFalse(Group.objects.exists())
+        self.assertEqual(Post.objects.count(), 4)
+
+    def test_old_comments(self):
+        """удаляются только комментарии старше срока"""
+        Comment.objects.filter(author=self.reader).update(
+            created=timezone.now() - timedelta(days=60))
+        self.purge('comments', days=30)
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Ответ автора'])
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk)
+                         .comments_count, 0)
+
+    def test_orphaned_media(self):
+        """удаляются только картинки, на которые не ссылается пост"""
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'posts'))
+            for name in ('used.gif', 'orphan.gif'):
+                with open(os.path.join(media_root, 'posts', name),
+                          'wb') as image:
+                    image.write(b'GIF89a')
+            Post.objects.filter(pk=self.reader_post.pk).update(
+                image='posts/used.gif')
+            self.purge('media', grace_hours=0)
+            self.assertEqual(
+                os.listdir(os.path.join(media_root, 'posts')), ['used.gif'])
+
+
+class DigestTest(TestCase):
+    def setUp(self):
+        self.authors = [User.objects.create_user(username='author{}'.format(
+            i)) for i in range(2)]
+        self.readers = [User.objects.create_user(
+            username='reader{}'.format(i),
+            email='reader{}@example.com'.format(i)) for i in range(3)]
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.authors[0])
+        Follow.objects.create(user=self.readers[0], author=self.authors[1])
+        Digest.objects.create(since=timezone.now() - timedelta(days=2),
+                              until=timezone.now() - timedelta(days=1))
+        self.posts = [Post.objects.create(text='Пост {}'.format(i),
+                                          author=author)
+                      for i, author in enumerate(self.authors)]
+
+    def test_one_email_per_follower(self):
+        """каждый подписчик получает одно письмо с постами своих авторов"""
+        out = StringIO()
+        call_command('send_digest', batch_size=2, stdout=out)
+        self.assertIn('подписчиков 3', out.getvalue())
+        self.assertEqual(len(mail.outbox), 3)
+        letters = {message.to[0]: message for message in mail.outbox}
+        self.assertIn('Пост 1', letters['reader0@example.com'].body)
+        self.assertIn('Пост 0', letters['reader0@example.com'].body)
+        self.assertIn('/posts/{}/'.format(self.posts[1].pk),
+                      letters['reader0@example.com'].body)
+        self.assertNotIn('Пост 1', letters['reader1@example.com'].body)
+        self.assertEqual(Digest.objects.first().followers, 3)
+
+    def test_interval_rolled_back_with_jobs(self):
+        """если задачи не поставились, интервал не записывается"""
+        with mock.patch('posts.digest.schedule',
+                        side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                call_command('send_digest', stdout=StringIO())
+        self.assertEqual(Digest.objects.count(), 1)
+        call_command('send_digest', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_next_interval_is_empty(self):
+        """посты не повторяются в следующем дайджесте"""
+        call_command('send_digest', stdout=StringIO())
+        mail.outbox = []
+        out = StringIO()
+        call_command('send_digest', stdout=out)
+        self.assertIn('ещё не прошёл', out.getvalue())
+        call_command('send_digest', force=True, stdout=StringIO())
+        self.assertEqual(mail.outbox, [])
@@ -1,7 +1,11 @@
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from posts.models import Group, Post, TEXT_LENGHT
+from posts.models import AuthorStats, Comment, Follow, Group, Post, TEXT_LENGHT
 
 User = get_user_model()
 
@@ -69,3 +73,66 @@ class GroupModelTest(TestCase):
         """правильно ли отображается значение поля __str__"""
         group = GroupModelTest.group
         self.assertEqual(str(group), group.title)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def _stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_post_counter(self):
+        """счётчик постов автора меняется при создании и удалении"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.assertEqual(self._stats(self.author).posts_count, 1)
+        post.delete()
+        self.assertEqual(self._stats(self.author).posts_count, 0)
+
+    def test_comment_counter(self):
+        """счётчик комментариев поста меняется при создании и удалении"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+    def test_comment_counter_rolled_back(self):
+        """счётчик не меняется, если комментарий не сохранился"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        with mock.patch('posts.search.index_comment',
+                        side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                Comment.objects.create(
+                    post=post, author=self.reader, text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_follow_counters(self):
+        """счётчики подписчиков и подписок меняются при подписке"""
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self._stats(self.author).followers_count, 1)
+        self.assertEqual(self._stats(self.reader).following_count, 1)
+        follow.delete()
+        self.assertEqual(self._stats(self.author).followers_count, 0)
+        self.assertEqual(self._stats(self.reader).following_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        """reconcile_counters исправляет разошедшиеся счётчики"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        AuthorStats.objects.filter(user=self.author).update(posts_count=42)
+        Post.objects.filter(pk=post.pk).update(comments_count=7)
+        AuthorStats.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(self._stats(self.author).posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(AuthorStats.objects.filter(user=self.reader).exists())
@@ -1,19 +1,43 @@
+import base64
 import random
 import shutil
 import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django import forms
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
 
-from posts.models import Post, Group, Follow
-from posts.utils import COUNT_POSTS
+from core import jobs
+from core.models import Job
+from core.query_budget import QueryBudgetTestMixin
+
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Group, Post, TimelineEntry)
+from posts import archive, thumbnails
+from posts.utils import (COUNT_COMMENTS, COUNT_POSTS, EstimatedCountPaginator,
+                         decode_cursor)
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 User = get_user_model()
 
 
@@ -22,17 +46,9 @@ class PostViewTest(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
-        small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x02\x00'
-            b'\x01\x00\x80\x00\x00\x00\x00\x00'
-            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
-            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
-            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
-            b'\x0A\x00\x3B'
-        )
         cls.uploaded = SimpleUploadedFile(
             name='small.gif',
-            content=small_gif,
+            content=SMALL_GIF,
             content_type='image/gif'
         )
         cls.user = User.objects.create_user(username='auth')
@@ -170,19 +186,39 @@ class PostViewTest(TestCase):
 
     def test_cache_context(self):
         '''Проверка кэширования страницы index'''
-        before_create_post = self.authorized_client.get(
-            reverse('posts:index'))
-        first_item_before = before_create_post.content
+        before_update = self.guest_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        after_update = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(after_update.content, before_update.content)
+        cache.clear()
+        after_clear = self.guest_client.get(reverse('posts:index'))
+        self.assertNotEqual(after_update.content, after_clear.content)
+
+    def test_cache_invalidated_on_write(self):
+        '''Новый пост сразу сбрасывает кэш лент, где он появляется'''
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+        ]
+        for url in urls:
+            self.guest_client.get(url)
         Post.objects.create(
             author=self.user,
             text='Проверка кэша',
             group=self.group)
-        after_create_post = self.authorized_client.get(reverse('posts:index'))
-        first_item_after = after_create_post.content
-        self.assertEqual(first_item_after, first_item_before)
-        cache.clear()
-        after_clear = self.authorized_client.get(reverse('posts:index'))
-        self.assertNotEqual(first_item_after, after_clear)
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Проверка кэша')
+
+    def test_cache_not_used_for_authorized(self):
+        '''Авторизованному пользователю страница не отдаётся из кэша'''
+        self.authorized_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(
+            text='Без сигналов', updated=timezone.now())
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Без сигналов')
 
 
 class PaginatorViewsTest(TestCase):
@@ -234,10 +270,109 @@ class PaginatorViewsTest(TestCase):
         ]
         for reverse_name, template in templates_names:
             with self.subTest(reverse_name=reverse_name):
-                response = self.authorized_client.get(reverse_name + '?page=2')
+                first_page = self.authorized_client.get(reverse_name)
+                cursor = first_page.context['page_obj'].next_cursor
+                response = self.authorized_client.get(
+                    reverse_name, {'after': cursor})
                 self.assertEqual(len(response.context['page_obj']),
                                  self.second_page)
 
+    def test_cursor_pages_do_not_overlap(self):
+        """страницы по курсору не пересекаются и идут в обе стороны"""
+        url = reverse('posts:index')
+        first_page = self.guest_client.get(url).context['page_obj']
+        second_page = self.guest_client.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+        self.assertFalse(first_page.has_previous())
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertEqual(len(set(first_page) | set(second_page)),
+                         self.all_posts)
+        back = self.guest_client.get(
+            url, {'before': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual(list(back), list(first_page))
+
+    def test_broken_cursor_shows_first_page(self):
+        """битый курсор отдаёт первую страницу"""
+        response = self.guest_client.get(
+            reverse('posts:index'), {'after': 'broken'})
+        self.assertEqual(len(response.context['page_obj']), self.first_page)
+
+    def test_out_of_range_cursor_shows_first_page(self):
+        """курсор с pk или датой вне диапазона -- как битый"""
+        now = '2020-01-01T00:00:00+00:00'
+        tokens = ['{}|{}'.format(now, 10 ** 30),
+                  '{}|{}'.format(now, -10 ** 30),
+                  '0001-01-01T00:00:00+05:00|1',
+                  '9999-12-31T23:59:59-05:00|1',
+                  # без часового пояса
+                  '2020-01-01T00:00:00|1']
+        post = Post.objects.first()
+        urls = [
+            (reverse('posts:index'), 'page_obj', self.first_page),
+            (reverse('posts:profile', kwargs={'username': 'auth'}),
+             'page_obj', self.first_page),
+            (reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+             'comments', 0),
+        ]
+        for raw in tokens:
+            token = base64.urlsafe_b64encode(raw.encode()).decode()
+            self.assertIsNone(decode_cursor(token))
+            for url, name, size in urls:
+                for param in ('after', 'before'):
+                    with self.subTest(token=raw, url=url, param=param):
+                        response = self.guest_client.get(
+                            url, {param: token})
+                        self.assertEqual(len(response.context[name]), size)
+            with self.subTest(token=raw, url='api'):
+                response = self.guest_client.get(
+                    reverse('api:index'), {'after': token})
+                self.assertEqual(response.status_code, 200)
+
+    def test_fragment(self):
+        """фрагмент ленты -- только карточки и курсор следующей порции"""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+            reverse('posts:follow_index'),
+        ]
+        Follow.objects.create(user=User.objects.create_user('reader'),
+                              author=self.user)
+        client = Client()
+        client.force_login(User.objects.get(username='reader'))
+        for url in urls:
+            with self.subTest(url=url):
+                page = client.get(url)
+                response = client.get(url, {'fragment': 1})
+                self.assertTemplateUsed(
+                    response, 'posts/includes/post_list.html')
+                self.assertTemplateNotUsed(response, 'base.html')
+                self.assertEqual(response['X-Next-Cursor'],
+                                 page.context['page_obj'].next_cursor)
+                last = client.get(url, {
+                    'fragment': 1, 'after': response['X-Next-Cursor']})
+                self.assertEqual(len(last.context['page_obj']),
+                                 self.second_page)
+                self.assertFalse(last.has_header('X-Next-Cursor'))
+
+    def test_fragment_is_not_cached(self):
+        """фрагмент для гостя не берётся из кэша полной страницы"""
+        url = reverse('posts:index')
+        self.guest_client.get(url, {'fragment': 1})
+        # update() не шлёт сигналов, версия ленты не меняется
+        Post.objects.update(text='Исправленный текст',
+                            updated=timezone.now())
+        response = self.guest_client.get(url, {'fragment': 1})
+        self.assertNotContains(response, '<html')
+        self.assertContains(response, 'Исправленный текст')
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_second_page_numbered(self):
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?page=2')
+        self.assertEqual(len(response.context['page_obj']),
+                         self.second_page)
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -303,3 +438,717 @@ class FollowViewsTest(TestCase):
         new_posts = response_unfollower.context['page_obj']
         self.assertNotIn(new_post, new_posts)
         self.assertEqual(len(new_posts), 0)
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def _feed(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_new_post_fanned_out_to_followers(self):
+        """новый пост автора раскладывается в ленты подписчиков"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+        self.assertIn(post, self._feed())
+
+    @override_settings(JOBS_EAGER=False)
+    def test_fan_out_runs_in_queue(self):
+        """раскладка поста и заполнение ленты идут задачами очереди"""
+        old = Post.objects.create(author=self.author, text='Старый пост')
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        jobs.run_pending()
+        self.assertEqual(self._feed(), [post, old])
+
+    @override_settings(JOBS_EAGER=False)
+    def test_fan_out_job_rolled_back_with_post(self):
+        """задача раскладки не остаётся в очереди без самого поста"""
+        with mock.patch('posts.search.index_post',
+                        side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                Post.objects.create(author=self.author, text='Пост')
+        self.assertFalse(Post.objects.filter(text='Пост').exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_unfollow_clears_timeline(self):
+        """после отписки посты автора пропадают из ленты"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'writer'}))
+        self.assertIn(post, self._feed())
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'writer'}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        self.assertEqual(self._feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_author_posts_pulled_on_read(self):
+        """посты популярного автора подмешиваются в ленту при чтении"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertIn(post, self._feed())
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_fan_out_trimmed(self):
+        """раскладка новых постов не растит ленту сверх предела"""
+        Follow.objects.create(user=self.user, author=self.author)
+        posts = [Post.objects.create(author=self.author, text=str(i))
+                 for i in range(4)]
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.user)
+                .values_list('post', flat=True)),
+            {posts[3].pk, posts[2].pk})
+
+    def test_feed_ordered_by_timeline_date(self):
+        """лента листается по дате записи ленты, а не поста"""
+        Follow.objects.create(user=self.user, author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            self._feed()
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"posts_timelineentry"."pub_date" AS "timeline_date"',
+                      sql)
+        self.assertIn('ORDER BY "timeline_date" DESC', sql)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('timeline_user_date_idx', plan)
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_backfill_trimmed(self):
+        """лента обрезается до TIMELINE_MAX_LENGTH"""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=str(i)) for i in range(5))
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertLessEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 2)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='auth', first_name='Иван')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Исходный текст', group=cls.group)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def _index(self):
+        return self.authorized_client.get(reverse('posts:index'))
+
+    def test_card_reused_until_post_changes(self):
+        """карточка берётся из кэша, пока пост не изменится"""
+        self._index()
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        self.assertContains(self._index(), 'Исходный текст')
+        self.post.text = 'Отредактированный текст'
+        self.post.save()
+        self.assertContains(self._index(), 'Отредактированный текст')
+
+    def test_card_invalidated_by_author_and_group(self):
+        """карточка обновляется при смене имени автора и группы"""
+        self._index()
+        self.user.first_name = 'Пётр'
+        self.user.save()
+        self.group.title = 'Новая группа'
+        self.group.save()
+        response = self._index()
+        self.assertContains(response, 'Пётр')
+        self.assertContains(response, 'Новая группа')
+
+    def test_cached_feeds_follow_author_and_group(self):
+        """страницы лент в кэше для анонимов видят правки автора и группы"""
+        guest = Client()
+        index = reverse('posts:index')
+        group = reverse('posts:group_list', kwargs={'slug': 'group'})
+        profile = reverse('posts:profile', kwargs={'username': 'auth'})
+        for url in (index, group, profile):
+            guest.get(url)
+        self.user.first_name = 'Пётр'
+        self.user.save()
+        for url in (index, group):
+            with self.subTest(url=url):
+                self.assertContains(guest.get(url), 'Пётр')
+        guest.get(profile)
+        self.group.title = 'Новая группа'
+        self.group.save()
+        self.assertContains(guest.get(profile), 'Новая группа')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(guest.get(profile).status_code, 404)
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.cats = Post.objects.create(
+            author=cls.user, text='Пушистые коты спят на солнце')
+        cls.dogs = Post.objects.create(
+            author=cls.user, text='Собаки гуляют, коты смотрят')
+        cls.birds = Post.objects.create(author=cls.user, text='Птицы поют')
+        Comment.objects.create(
+            post=cls.birds, author=cls.user, text='А коты охотятся')
+
+    def _search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_ranks_posts_and_comments(self):
+        """поиск находит посты и комментарии, посты выше комментариев"""
+        found = self._search('коты')
+        self.assertEqual(set(found), {self.cats, self.dogs, self.birds})
+        self.assertEqual(found[-1], self.birds)
+
+    def test_phrase_and_prefix(self):
+        """поддерживаются фразы в кавычках и префиксы"""
+        self.assertEqual(self._search('"коты спят"'), [self.cats])
+        self.assertEqual(self._search('пуш*'), [self.cats])
+        self.assertEqual(self._search('"спят коты"'), [])
+
+    def test_index_follows_changes(self):
+        """индекс обновляется при изменении и удалении поста"""
+        dogs = Post.objects.get(pk=self.dogs.pk)
+        dogs.text = 'Собаки гуляют'
+        dogs.save()
+        self.assertNotIn(dogs, self._search('коты'))
+        Post.objects.get(pk=self.cats.pk).delete()
+        self.assertEqual(self._search('пушистые'), [])
+
+    def test_special_characters_are_safe(self):
+        """служебные символы FTS не ломают запрос"""
+        self.assertEqual(self._search('AND OR ( NEAR "'), [])
+        self.assertEqual(self._search(''), [])
+
+    def test_admin_search_uses_index(self):
+        """поиск в админке идёт через полнотекстовый индекс"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'пуш*'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.cats])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_admin_search_is_not_capped(self):
+        """админка находит все совпадения, а не SEARCH_MAX_RESULTS"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        for name, expected in (('post', {self.cats, self.dogs, self.birds}),
+                               ('comment', set(Comment.objects.all()))):
+            with self.subTest(model=name):
+                response = self.client.get(
+                    reverse('admin:posts_{}_changelist'.format(name)),
+                    {'q': 'коты'})
+                cl = response.context['cl']
+                self.assertEqual(set(cl.result_list), expected)
+                self.assertEqual(cl.result_count, len(expected))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=SMALL_GIF,
+                content_type='image/gif'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_pages_do_not_resize(self):
+        """без готовой миниатюры показывается оригинал, sorl не нужен"""
+        Post.objects.filter(pk=self.post.pk).update(thumbnail='')
+        with mock.patch('sorl.thumbnail.get_thumbnail') as get, \
+                CaptureQueriesContext(connection) as queries:
+            for url in (reverse('posts:index'), reverse(
+                    'posts:post_detail', kwargs={'post_id': self.post.pk})):
+                self.assertContains(
+                    self.authorized_client.get(url), self.post.image.url)
+        get.assert_not_called()
+        self.assertFalse([query for query in queries
+                          if 'thumbnail_kvstore' in query['sql']])
+
+    def test_render_thumbnails(self):
+        """задача готовит миниатюру, и страницы показывают её"""
+        thumbnails.render_thumbnails(self.post.pk, self.post.image.name)
+        post = Post.objects.get(pk=self.post.pk)
+        thumbnail = get_thumbnail(post.image, thumbnails.THUMBNAIL_GEOMETRY,
+                                  **thumbnails.THUMBNAIL_OPTIONS)
+        self.assertEqual(post.thumbnail, thumbnail.name)
+        self.assertTrue(thumbnail.exists())
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+
+    def test_render_command(self):
+        """команда ставит задачи для постов без миниатюр"""
+        Post.objects.filter(pk=self.post.pk).update(thumbnail='')
+        out = StringIO()
+        call_command('render_thumbnails', stdout=out)
+        self.assertIn('Поставлено задач: 1', out.getvalue())
+        self.assertNotEqual(Post.objects.get(pk=self.post.pk).thumbnail, '')
+
+    def test_upload_schedules_thumbnails(self):
+        """загрузка картинки ставит подготовку миниатюр в очередь"""
+        with mock.patch('posts.views.thumbnails.schedule') as schedule:
+            self.authorized_client.post(reverse('posts:post_create'), {
+                'text': 'Новый пост',
+                'image': SimpleUploadedFile(
+                    name='new.gif',
+                    content=SMALL_GIF,
+                    content_type='image/gif'),
+            })
+        schedule.assert_called_once()
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание')
+        cls.post = Post.objects.create(
+            text='Пост', author=cls.author, group=cls.group)
+        Post.objects.bulk_create([
+            Post(text='Пост {}'.format(index), author=cls.author,
+                 group=cls.group)
+            for index in range(COUNT_POSTS + 2)
+        ])
+        for index in range(5):
+            commenter = User.objects.create_user(
+                username='commenter{}'.format(index))
+            Comment.objects.create(
+                post=cls.post, author=commenter, text='Комментарий')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+        cache.clear()
+
+    def test_pages_within_budget(self):
+        """страницы укладываются в бюджет запросов и не делают N+1"""
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'group'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            reverse('posts:search') + '?q=Пост',
+            reverse('posts:follow_index'),
+            reverse('posts:post_create'),
+        )
+        for client in (self.client, self.authorized_client):
+            for page in pages:
+                with self.subTest(page=page):
+                    cache.clear()
+                    self.assertWithinQueryBudget(page, client=client)
+
+    def test_writes_within_budget(self):
+        """запись поста и комментария укладывается в бюджет"""
+        self.assertWithinQueryBudget(
+            reverse('posts:post_create'), 'post', {'text': 'Новый'},
+            client=self.authorized_client)
+        self.assertWithinQueryBudget(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            'post', {'text': 'Ещё'}, client=self.authorized_client)
+        self.assertWithinQueryBudget(
+            reverse('posts:profile_unfollow', kwargs={'username': 'author'}),
+            client=self.authorized_client)
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Пост', author=cls.user)
+        start = timezone.now() - timedelta(days=1)
+        Comment.objects.bulk_create([
+            Comment(post=cls.post, author=cls.user,
+                    text='Комментарий {}'.format(index),
+                    created=start + timedelta(minutes=index))
+            for index in range(COUNT_COMMENTS + 3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_page(self):
+        """на странице поста первая порция комментариев от старых к новым"""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COUNT_COMMENTS)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        self.assertTrue(comments.has_next())
+        self.assertContains(response, reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk}))
+
+    def test_fragment_continues_from_cursor(self):
+        """фрагмент «показать ещё» отдаёт следующую порцию"""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        cursor = response.context['comments'].next_cursor
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'after': cursor})
+        self.assertTemplateUsed(response, 'posts/includes/comments.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        texts = [comment.text for comment in response.context['comments']]
+        self.assertEqual(texts, [
+            'Комментарий {}'.format(index)
+            for index in range(COUNT_COMMENTS, COUNT_COMMENTS + 3)])
+        self.assertFalse(response.context['comments'].has_next())
+
+    def test_new_comment_redirect_shows_it(self):
+        """после комментария открывается порция, где он виден"""
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Новый комментарий'}, follow=True)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COUNT_COMMENTS)
+        self.assertEqual(comments[len(comments) - 1].text,
+                         'Новый комментарий')
+        self.assertTrue(comments.has_previous())
+        self.assertFalse(comments.has_next())
+        self.assertTrue(response.redirect_chain[0][0].endswith('#comments'))
+
+    def test_fragment_unknown_post(self):
+        """фрагмент комментариев несуществующего поста -- 404"""
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_post_body_cache_follows_edits(self):
+        """кэш тела поста сбрасывается при редактировании"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(
+            text='Новый текст', updated=timezone.now())
+        self.assertContains(self.client.get(url), 'Новый текст')
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        Post.objects.bulk_create([
+            Post(text='Пост {}'.format(index), author=cls.user)
+            for index in range(COUNT_POSTS * 30)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_elided_page_range(self):
+        """ссылки только на крайние страницы и соседние с текущей"""
+        paginator = EstimatedCountPaginator(range(1000), COUNT_POSTS)
+        ellipsis = paginator.ELLIPSIS
+        cases = {
+            1: [1, 2, 3, ellipsis, 100],
+            50: [1, ellipsis, 48, 49, 50, 51, 52, ellipsis, 100],
+            99: [1, ellipsis, 97, 98, 99, 100],
+        }
+        for number, expected in cases.items():
+            with self.subTest(number=number):
+                self.assertEqual(
+                    list(paginator.get_elided_page_range(number)), expected)
+        short = EstimatedCountPaginator(range(50), COUNT_POSTS)
+        self.assertEqual(list(short.get_elided_page_range(3)),
+                         [1, 2, 3, 4, 5])
+
+    @override_settings(PAGINATION_COUNT_THRESHOLD=100)
+    def test_large_count_is_cached(self):
+        """большие COUNT выполняются раз за PAGINATION_COUNT_TIMEOUT"""
+        queryset = Post.objects.order_by('-pub_date')
+        self.assertEqual(
+            EstimatedCountPaginator(queryset, COUNT_POSTS).count, 300)
+        Post.objects.create(text='Новый', author=self.user)
+        with self.assertNumQueries(1):
+            count = EstimatedCountPaginator(queryset, COUNT_POSTS).count
+        self.assertEqual(count, 300)
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_page_links_are_bounded(self):
+        """на странице ленты ссылок не больше окна вокруг текущей"""
+        response = self.client.get(reverse('posts:index'), {'page': 15})
+        self.assertContains(response, 'page=30')
+        self.assertContains(response, '…', count=2)
+        self.assertNotContains(response, 'page=20"')
+
+    def _admin_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries]
+
+    @override_settings(PAGINATION_COUNT_THRESHOLD=100)
+    def test_admin_changelist_skips_full_count(self):
+        """список постов в админке не считает всю таблицу каждый раз"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        url = 'admin:posts_post_changelist'
+        self._admin_queries(url)
+        full_count = [sql for sql in self._admin_queries(url)
+                      if 'COUNT(*)' in sql and 'LIMIT' not in sql]
+        self.assertEqual(full_count, [])
+        response = self.client.get(reverse(url))
+        self.assertIsNone(response.context['cl'].full_result_count)
+        self.assertEqual(response.context['cl'].result_count, 300)
+
+    def test_admin_changelist_queries_do_not_grow(self):
+        """связанные объекты строк списка не читаются по одному"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        posts = list(Post.objects.all()[:2])
+        Comment.objects.create(post=posts[0], author=admin, text='Раз')
+        for url in ('admin:posts_post_changelist',
+                    'admin:posts_comment_changelist'):
+            with self.subTest(url=url):
+                self._admin_queries(url)
+                before = len(self._admin_queries(url))
+                group = Group.objects.create(
+                    title=url, slug=url.replace(':', '-'))
+                Post.objects.update(group=group)
+                Comment.objects.bulk_create([
+                    Comment(post=post, author=self.user, text='Ещё')
+                    for post in posts * 5
+                ])
+                self.assertEqual(len(self._admin_queries(url)), before)
+
+
+class ArchiveTest(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_posts = [
+            Post.objects.create(text='Старый пост {}'.format(index),
+                                author=cls.user)
+            for index in range(COUNT_POSTS)
+        ]
+        Post.objects.filter(pk__in=[post.pk for post in cls.old_posts]
+                            ).update(pub_date=timezone.now()
+                                     - timedelta(days=400))
+        cls.old_post = cls.old_posts[0]
+        Comment.objects.create(
+            post=cls.old_post, author=cls.reader, text='Старый комментарий')
+        cls.new_post = Post.objects.create(text='Новый пост', author=cls.user)
+        archive.archive_batch(archive.cutoff())
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_posts_moved(self):
+        """старые посты и комментарии перенесены, новые остались"""
+        self.assertEqual(list(Post.objects.all()), [self.new_post])
+        self.assertEqual(ArchivedPost.objects.count(), COUNT_POSTS)
+        self.assertEqual(ArchivedComment.objects.get().post_id,
+                         self.old_post.pk)
+        self.assertEqual(
+            ArchivedPost.objects.get(pk=self.old_post.pk).comments_count, 1)
+
+    def test_profile_merges_archive(self):
+        """профиль листает основную и архивную таблицы как одну ленту"""
+        url = reverse('posts:profile', args=[self.user.username])
+        response = self.assertWithinQueryBudget(url)
+        first = list(response.context['page_obj'])
+        self.assertEqual(first[0], self.new_post)
+        self.assertTrue(all(post.is_archived for post in first[1:]))
+        after = response.context['page_obj'].next_cursor
+        response = self.client.get(url, {'after': after})
+        second = list(response.context['page_obj'])
+        self.assertEqual(len(first) + len(second), COUNT_POSTS + 1)
+        self.assertFalse(response.context['page_obj'].has_next())
+        self.assertEqual(
+            response.context['author'].stats.posts_count, COUNT_POSTS + 1)
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_profile_pages_merge_archive(self):
+        """постраничный режим тоже видит архив"""
+        response = self.client.get(
+            reverse('posts:profile', args=[self.user.username]),
+            {'page': 2})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.paginator.count, COUNT_POSTS + 1)
+        self.assertEqual(len(page_obj), 1)
+        self.assertEqual(page_obj[0].pk, self.old_post.pk)
+
+    def test_archived_post_detail(self):
+        """архивный пост открывается по прежнему адресу без формы ответа"""
+        url = reverse('posts:post_detail', args=[self.old_post.pk])
+        response = self.assertWithinQueryBudget(url)
+        self.assertTrue(response.context['post'].is_archived)
+        self.assertContains(response, 'Старый комментарий')
+        self.assertNotContains(
+            response, reverse('posts:add_comment', args=[self.old_post.pk]))
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.old_post.pk]))
+        self.assertContains(response, 'Старый комментарий')
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.old_post.pk]),
+            {'text': 'Поздно'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_finds_archived(self):
+        """поиск находит посты в архиве"""
+        response = self.client.get(reverse('posts:search'), {'q': 'Старый'})
+        self.assertEqual(len(response.context['page_obj']), COUNT_POSTS)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост')
+        self.client.force_login(self.reader)
+        self.urls = [
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:group_list', kwargs={'slug': 'group'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def test_not_modified(self):
+        """неизменённая страница отдаёт 304 без рендера шаблона"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                # страница своя у каждого посетителя: только ETag
+                self.assertFalse(response.has_header('Last-Modified'))
+                not_modified = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertFalse(not_modified.templates)
+
+    def test_new_post_changes_etag(self):
+        """новый пост меняет ETag профиля и группы"""
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls[:2]}
+        Post.objects.create(author=self.author, group=self.group, text='Ещё')
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_author_post_changes_post_etag(self):
+        """новый пост автора меняет счётчик и ETag его старых постов"""
+        url = self.urls[2]
+        etag = self.client.get(url)['ETag']
+        Post.objects.create(author=self.author, text='Ещё')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['author'].stats.posts_count, 2)
+
+    def test_archiving_changes_post_etag(self):
+        """после переноса в архив страница поста без формы комментария"""
+        post = Post.objects.create(author=self.author, text='Без группы')
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        etag = self.client.get(url)['ETag']
+        archive.archive_batch(timezone.now() + timedelta(days=1), 10)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Пост в архиве')
+
+    def test_first_response_etag_is_final(self):
+        """ETag первого ответа уже учитывает выданную cookie CSRF"""
+        client = Client()
+        url = self.urls[0]
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_comment_changes_etag(self):
+        """новый комментарий меняет ETag страницы поста"""
+        url = self.urls[2]
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Ответ')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Ответ')
+
+    def test_unknown_feed_versions_expire(self):
+        """версии несуществующих лент не остаются в кэше навсегда"""
+        url = reverse('posts:group_list', kwargs={'slug': 'no-such-group'})
+        with mock.patch('posts.cache.cache.add',
+                        wraps=cache.add) as add:
+            response = Client().get(url)
+        self.assertEqual(response.status_code, 404)
+        timeouts = {args[0]: args[2] for args, kwargs in add.call_args_list}
+        self.assertIn('feed_version:group:no-such-group', timeouts)
+        self.assertNotIn(None, timeouts.values())
+
+    def test_edited_comment_changes_etag(self):
+        """правка комментария меняет ETag страницы поста"""
+        url = self.urls[2]
+        comment = Comment.objects.create(
+            post=self.post, author=self.reader, text='Ответ')
+        etag = self.client.get(url)['ETag']
+        comment.text = 'Исправленный ответ'
+        comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Исправленный ответ')
+
+    def test_author_rename_changes_group_etag(self):
+        """новое имя автора меняет ETag группы с его постами"""
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        self.author.first_name = 'Пётр'
+        self.author.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Пётр')
+
+    def test_etag_depends_on_user(self):
+        """у другого посетителя своя страница и свой ETag"""
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        guest = Client().get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(guest.status_code, 200)
+        self.assertNotEqual(guest['ETag'], etag)
@@ -0,0 +1,47 @@
+"""Фоновая подготовка миниатюр картинок постов.
+
+Запросы никогда не ресайзят картинки и не обращаются к sorl: шаблоны
+показывают миниатюру, только если её имя уже записано в поле thumbnail,
+а до того -- оригинал. Миниатюры рендерит задача очереди core.jobs после
+загрузки картинки; для старых постов её ставит команда
+render_thumbnails.
+"""
+from django.core.files.storage import default_storage
+
+from core.jobs import job
+
+# размер, который показывают шаблоны постов
+THUMBNAIL_GEOMETRY = '960x339'
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+
+
+def url(post):
+    if post.thumbnail:
+        return default_storage.url(post.thumbnail)
+    return post.image.url
+
+
+@job(priority=10)
+def render_thumbnails(post_id, name):
+    from sorl.thumbnail import get_thumbnail
+
+    from . import cache
+    from .models import ArchivedPost, Post
+
+    thumbnail = get_thumbnail(name, THUMBNAIL_GEOMETRY, **THUMBNAIL_OPTIONS)
+    for model in (Post, ArchivedPost):
+        # картинку могли заменить, пока задача ждала в очереди
+        posts = model.objects.filter(pk=post_id, image=name)
+        row = posts.values_list('author__username', 'group__slug').first()
+        if row is not None and posts.update(thumbnail=thumbnail.name):
+            # страницы с постом перестраиваются уже с миниатюрой
+            username, slug = row
+            cache.bump(cache.index_feed(), cache.profile_feed(username),
+                       cache.post_feed(post_id),
+                       *([cache.group_feed(slug)] if slug else []))
+
+
+def schedule(post):
+    """Ставит подготовку миниатюр в очередь задач."""
+    if post.image:
+        render_thumbnails.enqueue(post.pk, post.image.name)
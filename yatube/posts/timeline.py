@@ -0,0 +1,134 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост раскладывается в ленты всех подписчиков автора, поэтому
+страница подписок читается одним диапазоном по индексу (user, pub_date).
+Посты авторов, у которых подписчиков больше TIMELINE_FANOUT_LIMIT,
+не раскладываются, а подмешиваются в ленту при чтении.
+
+Раскладка нового поста и заполнение ленты после подписки идут задачами
+очереди core.jobs, а не в запросе. Каждая лента обрезается до
+TIMELINE_MAX_LENGTH записей.
+"""
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery
+
+from core.jobs import job
+from .models import AuthorStats, Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+# дата, по которой сортируется и листается лента подписок
+ORDER_FIELD = 'timeline_date'
+
+
+def is_fanout_author(author_id):
+    return not AuthorStats.objects.filter(
+        user_id=author_id,
+        followers_count__gte=settings.TIMELINE_FANOUT_LIMIT
+    ).exists()
+
+
+def pulled_authors(user):
+    """Авторы из подписок user, чьи посты подмешиваются при чтении."""
+    return list(Follow.objects.filter(
+        user=user,
+        author__stats__followers_count__gte=settings.TIMELINE_FANOUT_LIMIT
+    ).values_list('author', flat=True))
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out(post):
+    if not is_fanout_author(post.author_id):
+        return
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True))
+    batch = []
+    for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, post=post, pub_date=post.pub_date))
+        if len(batch) >= BATCH_SIZE:
+            _insert(batch)
+            trim_many([entry.user_id for entry in batch])
+            batch = []
+    _insert(batch)
+    trim_many([entry.user_id for entry in batch])
+
+
+def backfill(user_id, author_id):
+    if not is_fanout_author(author_id):
+        return
+    posts = (Post.objects.filter(author_id=author_id)
+             .order_by('-pub_date')
+             .values_list('pk', 'pub_date')[:settings.TIMELINE_MAX_LENGTH])
+    _insert([TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+             for pk, pub_date in posts])
+    trim(user_id)
+
+
+@job(priority=5)
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        fan_out(post)
+
+
+@job(priority=5)
+def backfill_follow(user_id, author_id):
+    # подписку могли отменить, пока задача ждала в очереди
+    if Follow.objects.filter(user_id=user_id, author_id=author_id).exists():
+        backfill(user_id, author_id)
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def trim_many(user_ids):
+    """Оставляет в лентах user_ids не больше TIMELINE_MAX_LENGTH записей.
+
+    Один запрос на пачку: граница каждой ленты -- подзапрос по индексу
+    (user, pub_date).
+    """
+    if not user_ids:
+        return
+    limit = settings.TIMELINE_MAX_LENGTH
+    boundary = (TimelineEntry.objects.filter(user=OuterRef('user'))
+                .order_by('-pub_date')
+                .values('pub_date')[limit:limit + 1])
+    TimelineEntry.objects.filter(
+        user__in=user_ids, pub_date__lte=Subquery(boundary)).delete()
+
+
+def trim(user):
+    """Оставляет в ленте user не больше TIMELINE_MAX_LENGTH записей."""
+    trim_many([getattr(user, 'pk', user)])
+
+
+def rebuild(user):
+    TimelineEntry.objects.filter(user=user).delete()
+    authors = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True)
+    for author_id in authors:
+        backfill(user.pk, author_id)
+
+
+def timeline_posts(user):
+    """Посты ленты user с датой ORDER_FIELD для сортировки и курсоров.
+
+    Без подмешиваемых авторов лента сортируется по дате записи ленты,
+    то есть читается диапазоном индекса timeline_user_date_idx.
+    """
+    pulled = pulled_authors(user)
+    if not pulled:
+        posts = Post.objects.filter(timeline_entries__user=user).annotate(
+            **{ORDER_FIELD: F('timeline_entries__pub_date')})
+    else:
+        stored = TimelineEntry.objects.filter(user=user).values('post')
+        posts = Post.objects.filter(
+            Q(pk__in=stored) | Q(author__in=pulled)
+        ).annotate(**{ORDER_FIELD: F('pub_date')})
+    return posts.order_by('-' + ORDER_FIELD, '-pk')
@@ -1,11 +1,291 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import hashlib
+from collections.abc import Sequence
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Page, Paginator
+from django.db.models import Q, QuerySet
+from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .models import Comment, Post
 
 COUNT_POSTS = 10
+COUNT_COMMENTS = 20
+
+# ?fragment=1 отдаёт только карточки постов для бесконечной прокрутки
+FRAGMENT_PARAM = 'fragment'
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+# pk курсора должен помещаться в BIGINT
+MIN_PK, MAX_PK = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_cursor(value, pk):
+    raw = '{}|{}'.format(value.isoformat(), pk).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (значение в UTC, pk) или None для битого токена.
+
+    Битыми считаются и значения, которые не дойдут до базы: дата без
+    часового пояса или вне диапазона datetime после перевода в UTC,
+    pk вне знакового 64-битного целого.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, pk = raw.decode().split('|')
+        value = parse_datetime(value)
+        pk = int(pk)
+        if value is None or timezone.is_naive(value):
+            return None
+        if not MIN_PK <= pk <= MAX_PK:
+            return None
+        value = value.astimezone(timezone.utc)
+    except (binascii.Error, UnicodeDecodeError, ValueError, OverflowError):
+        return None
+    return value, pk
+
+
+class CursorPage(Sequence):
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page of {} objects>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Постраничный вывод по ключу (field, pk) без COUNT и OFFSET.
+
+    Стоимость любой страницы одинакова: это выборка per_page + 1 строк
+    по индексу, начиная с позиции из непрозрачного токена ?after=/?before=.
+    """
+
+    def __init__(self, object_list, per_page, field='pub_date',
+                 descending=True):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.field = field
+        self.descending = descending
+
+    def _ordering(self, reverse):
+        prefix = '-' if self.descending != reverse else ''
+        return prefix + self.field, prefix + 'pk'
+
+    def _seek(self, queryset, cursor, reverse):
+        value, pk = cursor
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        return queryset.filter(
+            Q(**{'{}__{}'.format(self.field, lookup): value})
+            | Q(**{self.field: value, 'pk__' + lookup: pk})
+        )
+
+    def _page_part(self, queryset, cursor, reverse):
+        if cursor is not None:
+            queryset = self._seek(queryset, cursor, reverse)
+        queryset = queryset.order_by(*self._ordering(reverse))
+        return queryset[:self.per_page + 1]
 
+    def page_queryset(self, cursor=None, reverse=False):
+        parts = getattr(self.object_list, 'parts', None)
+        if parts is None:
+            return self._page_part(self.object_list, cursor, reverse)
+        # несколько таблиц (ArchiveUnion): страница из каждой и слияние
+        items = [item for part in parts
+                 for item in self._page_part(part, cursor, reverse)]
+        items.sort(key=lambda item: (getattr(item, self.field), item.pk),
+                   reverse=self.descending != reverse)
+        return items[:self.per_page + 1]
 
-def use_paginator(request, list):
-    paginator = Paginator(list, COUNT_POSTS)
+    def _cursor(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
+
+    def get_page(self, query):
+        before = decode_cursor(query.get('before'))
+        after = None if before else decode_cursor(query.get('after'))
+        items = list(self.page_queryset(
+            before or after, reverse=before is not None))
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if before:
+            items.reverse()
+        if not items:
+            if before:
+                return self.get_page({})
+            return CursorPage([], self)
+        has_next = has_more if not before else True
+        has_previous = has_more if before else after is not None
+        return CursorPage(
+            items,
+            self,
+            next_cursor=self._cursor(items[-1]) if has_next else None,
+            previous_cursor=self._cursor(items[0]) if has_previous else None,
+        )
+
+
+class ElidedPage(Page):
+    @property
+    def elided_page_range(self):
+        return self.paginator.get_elided_page_range(self.number)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator с дешёвым COUNT и сокращённым списком страниц.
+
+    До PAGINATION_COUNT_THRESHOLD строк число считается точно запросом
+    с LIMIT, больше -- берётся из кэша на PAGINATION_COUNT_TIMEOUT
+    секунд, так что полный COUNT выполняется не чаще раза за этот срок.
+    """
+    ELLIPSIS = '…'
+
+    @cached_property
+    def count(self):
+        parts = getattr(self.object_list, 'parts', None)
+        if parts is not None:
+            return sum(type(self)(part, self.per_page).count
+                       for part in parts)
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        queryset = self.object_list.order_by()
+        threshold = settings.PAGINATION_COUNT_THRESHOLD
+        bounded = queryset[:threshold + 1].count()
+        if bounded <= threshold:
+            return bounded
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        key = 'page_count:' + hashlib.md5(sql.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_TIMEOUT)
+        return count
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Первые и последние страницы и окно вокруг текущей."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1,
+                             self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+    def _get_page(self, *args, **kwargs):
+        return ElidedPage(*args, **kwargs)
+
+
+def use_paginator(request, list, mode=None, field='pub_date'):
+    if (mode or settings.POSTS_PAGINATION) == 'cursor':
+        return CursorPaginator(
+            list, COUNT_POSTS, field=field).get_page(request.GET)
+    paginator = EstimatedCountPaginator(list, COUNT_POSTS)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
     return page_obj
+
+
+def is_fragment(request):
+    return request.GET.get(FRAGMENT_PARAM) == '1'
+
+
+def render_feed(request, template, context, **card_options):
+    """Страница ленты или, в режиме фрагмента, только её карточки.
+
+    card_options (show_group_link, show_profile_link) передаются шаблону
+    карточки в обоих режимах. Курсор следующей порции фрагмент отдаёт
+    в заголовке X-Next-Cursor.
+    """
+    context.update(card_options)
+    if not is_fragment(request):
+        return render(request, template, context)
+    response = render(request, 'posts/includes/post_list.html', context)
+    next_cursor = getattr(context['page_obj'], 'next_cursor', None)
+    if next_cursor:
+        response[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def comments_page(request, post):
+    """Порция комментариев поста (в том числе архивного) от старых к новым."""
+    comments = post.comments.select_related('author')
+    paginator = CursorPaginator(
+        comments, COUNT_COMMENTS, field='created', descending=False)
+    return paginator.get_page(request.GET)
+
+
+def comment_page_query(comment):
+    """?after= для порции комментариев, которая заканчивается comment.
+
+    Пустая строка, если comment попадает в первую порцию.
+    """
+    anchor = (Comment.objects.filter(post_id=comment.post_id)
+              .filter(Q(created__lt=comment.created)
+                      | Q(created=comment.created, pk__lt=comment.pk))
+              .order_by('-created', '-pk')
+              .values_list('created', 'pk')
+              [COUNT_COMMENTS - 1:COUNT_COMMENTS])
+    if not anchor:
+        return ''
+    return '?after=' + encode_cursor(*anchor[0])
+
+
+@contextmanager
+def keep_dates():
+    """Отключает auto_now/auto_now_add у дат постов и комментариев.
+
+    Нужно массовой загрузке, чтобы сохранить даты из источника.
+    """
+    fields = (Post._meta.get_field('pub_date'),
+              Post._meta.get_field('updated'),
+              Comment._meta.get_field('created'))
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field, *flags in saved:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
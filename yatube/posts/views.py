@@ -1,40 +1,65 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
-
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from core.db_router import primary
+from core.query_budget import query_budget
+from . import thumbnails
+from .cache import cache_feed, group_feed, index_feed, profile_feed
+from .conditional import page_etag, post_page_etag
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
-from . utils import use_paginator
+from .search import search_post_ids
+from . utils import (comment_page_query, comments_page, is_fragment,
+                     render_feed, use_paginator)
+from . import timeline
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(4)
+@cache_feed(index_feed)
 def index(request):
-    post_list = Post.objects.all().select_related('group', 'author')
+    post_list = Post.objects.feed()
     context = {
         'page_obj': use_paginator(request, post_list),
     }
 
     template = 'posts/index.html'
-    return render(request, template, context)
+    return render_feed(request, template, context,
+                       show_group_link=True, show_profile_link=True)
 
 
+@query_budget(5)
+@primary()
+@condition(
+    etag_func=lambda request, slug: page_etag(request, group_feed(slug)))
+@cache_feed(group_feed, 'slug')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all().select_related('author').order_by(
-        '-pub_date')
+    post_list = group.posts.feed()
     context = {
         'group': group,
         'page_obj': use_paginator(request, post_list),
     }
 
     template = 'posts/group_list.html'
-    return render(request, template, context)
+    return render_feed(request, template, context,
+                       show_group_link=False, show_profile_link=True)
 
 
+@query_budget(7)
+@primary()
+@condition(
+    etag_func=lambda request, username: page_etag(
+        request, profile_feed(username)))
+@cache_feed(profile_feed, 'username')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all().select_related('group')
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    post_list = Post.with_archive.filter(author=author).feed()
     following = (request.user.is_authenticated
+                 and not is_fragment(request)
                  and Follow.objects.filter(
                      user=request.user,
                      author=author).exists())
@@ -45,24 +70,55 @@ def profile(request, username):
     }
 
     template = "posts/profile.html"
-    return render(request, template, context)
+    return render_feed(request, template, context,
+                       show_group_link=True, show_profile_link=False)
 
 
+@query_budget(9)
+@primary()
+@condition(etag_func=post_page_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post.objects.select_related('author'), pk=post_id)
+    post = get_object_or_404(
+        Post.with_archive.select_related('author__stats', 'group'),
+        pk=post_id)
     author = post.author
-    comments = post.comments.all()
     form = CommentForm()
     context = {
         "post": post,
         "author": author,
-        'comments': comments,
+        'comments': comments_page(request, post),
         'form': form,
     }
     template = "posts/post_detail.html"
     return render(request, template, context)
 
 
+@query_budget(4)
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.with_archive.only('pk'), pk=post_id)
+    context = {
+        'post_id': post_id,
+        'comments': comments_page(request, post),
+    }
+    template = 'posts/includes/comments.html'
+    return render(request, template, context)
+
+
+@query_budget(5)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = use_paginator(request, search_post_ids(query), mode='pages')
+    posts = Post.with_archive.feed().in_bulk(list(page_obj))
+    page_obj.object_list = [posts[pk] for pk in page_obj if pk in posts]
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    template = 'posts/search.html'
+    return render(request, template, context)
+
+
+@query_budget(10)
 @login_required
 def post_create(request):
     form = PostForm(
@@ -72,7 +128,9 @@ def post_create(request):
     if form.is_valid():
         temp_form = form.save(commit=False)
         temp_form.author = request.user
-        temp_form.save()
+        with transaction.atomic():
+            temp_form.save()
+            thumbnails.schedule(temp_form)
         return redirect(
             'posts:profile', temp_form.author
         )
@@ -81,10 +139,11 @@ def post_create(request):
     return render(request, template, {'form': form})
 
 
+@query_budget(10)
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect(
             'posts:post_detail', post_id
         )
@@ -94,7 +153,13 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
-        form.save()
+        if 'image' in form.changed_data:
+            # миниатюра старой картинки больше не подходит
+            post.thumbnail = ''
+        with transaction.atomic():
+            form.save()
+            if 'image' in form.changed_data:
+                thumbnails.schedule(post)
         return redirect(
             'posts:post_detail', post_id
         )
@@ -108,6 +173,7 @@ def post_edit(request, post_id):
     return render(request, template, context)
 
 
+@query_budget(10)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
@@ -117,21 +183,29 @@ def add_comment(request, post_id):
         comment.author = request.user
         comment.post = post
         comment.save()
+        # порция, в которой виден новый комментарий
+        return redirect('{}{}#comments'.format(
+            reverse('posts:post_detail', kwargs={'post_id': post_id}),
+            comment_page_query(comment)))
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(5)
 @login_required
 def follow_index(request):
-    posts_list = Post.objects.filter(author__following__user=request.user)
+    posts_list = timeline.timeline_posts(request.user).feed()
     template = 'posts/follow.html'
     title = 'Публикации избранных авторов'
     context = {
         'title': title,
-        "page_obj": use_paginator(request, posts_list),
+        "page_obj": use_paginator(request, posts_list,
+                                  field=timeline.ORDER_FIELD),
     }
-    return render(request, template, context)
+    return render_feed(request, template, context,
+                       show_group_link=True, show_profile_link=True)
 
 
+@query_budget(12)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
@@ -141,6 +215,7 @@ def profile_follow(request, username):
     return redirect("posts:profile", username=username)
 
 
+@query_budget(12)
 @login_required
 def profile_unfollow(request, username):
     follow_author = get_object_or_404(User, username=username)
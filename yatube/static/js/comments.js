@@ -0,0 +1,24 @@
+// "Показать ещё комментарии": подгружает следующую порцию фрагментом
+// вместо перехода на новую страницу. Без JS ссылка работает как обычная.
+document.addEventListener('click', function (event) {
+  var link = event.target.closest('[data-load-more]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  link.classList.add('disabled');
+  fetch(link.dataset.fragmentUrl, {credentials: 'same-origin'})
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.status);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      link.insertAdjacentHTML('beforebegin', html);
+      link.remove();
+    })
+    .catch(function () {
+      window.location = link.href;
+    });
+});
@@ -0,0 +1,60 @@
+// Бесконечная прокрутка лент: у конца списка подгружает следующую порцию
+// карточек фрагментом (?fragment=1), курсор берёт из X-Next-Cursor.
+// Без JS и в режиме ?page=N остаётся обычный переключатель страниц.
+(function () {
+  var feed = document.querySelector('[data-feed][data-next-cursor]');
+  if (!feed || !('IntersectionObserver' in window)) {
+    return;
+  }
+  var nav = feed.nextElementSibling;
+  var sentinel = document.createElement('div');
+  feed.after(sentinel);
+  var loading = false;
+
+  function stop() {
+    observer.disconnect();
+    sentinel.remove();
+  }
+
+  function load() {
+    var params = new URLSearchParams(window.location.search);
+    params.delete('before');
+    params.set('after', feed.dataset.nextCursor);
+    var page = window.location.pathname + '?' + params;
+    params.set('fragment', '1');
+    loading = true;
+    fetch(window.location.pathname + '?' + params, {credentials: 'same-origin'})
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.status);
+        }
+        var cursor = response.headers.get('X-Next-Cursor');
+        return response.text().then(function (html) {
+          feed.insertAdjacentHTML('beforeend', '<hr>' + html);
+          loading = false;
+          if (cursor) {
+            feed.dataset.nextCursor = cursor;
+            // если конец ленты всё ещё виден, наблюдатель сработает снова
+            observer.unobserve(sentinel);
+            observer.observe(sentinel);
+          } else {
+            stop();
+          }
+        });
+      })
+      .catch(function () {
+        window.location = page;
+      });
+  }
+
+  var observer = new IntersectionObserver(function (entries) {
+    if (entries[0].isIntersecting && !loading) {
+      load();
+    }
+  });
+  if (nav && nav.tagName === 'NAV') {
+    // ссылки страниц не нужны, пока работает прокрутка
+    nav.hidden = true;
+  }
+  observer.observe(sentinel);
+})();
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+UserModel = get_user_model()
+
+
+def user_cache_key(user_id):
+    return 'auth_user:{}'.format(user_id)
+
+
+class CachedSessionHash:
+    """Хеш сессии из кэша, пока пароль пользователя не загружен."""
+
+    def __init__(self, user, session_hash):
+        self.user = user
+        self.session_hash = session_hash
+
+    def __call__(self):
+        if 'password' in self.user.__dict__:
+            # пароль прочитан или сменён: хеш считается заново
+            return AbstractBaseUser.get_session_auth_hash(self.user)
+        return self.session_hash
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который берёт пользователя сессии из кэша.
+
+    В кэше лежат поля пользователя без хеша пароля и готовый хеш сессии
+    (HMAC от пароля), которым django.contrib.auth.get_user проверяет
+    сессию. Пароль из кэшированного пользователя читается из базы при
+    первом обращении, как отложенное поле. Запись сбрасывается сигналами
+    при сохранении пользователя (в том числе при смене пароля) и при
+    выходе.
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        data = cache.get(key)
+        if data is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, {
+                    'fields': {
+                        field.attname: getattr(user, field.attname)
+                        for field in UserModel._meta.concrete_fields
+                        if field.attname != 'password'},
+                    'session_hash': user.get_session_auth_hash(),
+                }, settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+        fields = data['fields']
+        user = UserModel.from_db(
+            DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+        user.get_session_auth_hash = CachedSessionHash(
+            user, data['session_hash'])
+        return user if self.user_can_authenticate(user) else None
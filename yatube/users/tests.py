@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .backends import user_cache_key
+
+User = get_user_model()
+
+
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', password='old-password-123')
+        self.client = Client()
+        self.client.login(username='user', password='old-password-123')
+
+    def test_no_queries_for_session_and_user(self):
+        """сессия и пользователь берутся из кэша без запросов к базе"""
+        url = reverse('about:author')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_no_password_hash_in_cache(self):
+        """в кэше нет хеша пароля, но пароль проверяется"""
+        self.client.get(reverse('about:author'))
+        cached = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', cached['fields'])
+        self.assertNotIn(self.user.password, str(cached))
+        response = self.client.get(reverse('about:author'))
+        self.assertTrue(
+            response.context['user'].check_password('old-password-123'))
+
+    def test_password_change_resets_cache(self):
+        """после смены пароля старые сессии не действуют"""
+        self.client.get(reverse('about:author'))
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password-456')
+        user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_change_view_keeps_session(self):
+        """смена пароля через форму не разлогинивает самого пользователя"""
+        # пользователь запроса берётся из кэша
+        self.client.get(reverse('about:author'))
+        self.client.post(reverse('users:password_change_form'), {
+            'old_password': 'old-password-123',
+            'new_password1': 'new-password-456',
+            'new_password2': 'new-password-456',
+        })
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_resets_cache(self):
+        """выход удаляет пользователя из кэша"""
+        self.client.get(reverse('about:author'))
+        self.client.get(reverse('users:logout'))
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
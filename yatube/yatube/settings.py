@@ -47,21 +47,29 @@ INSTALLED_APPS = [
     'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
+    'api.apps.ApiConfig',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # после сессий: метка чтения из default хранится по пользователю
+    'core.db_router.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# debug_toolbar нужен только при разработке
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'yatube.urls'
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -95,9 +103,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # сайт и воркеры очереди пишут в базу одновременно
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# реплики только для чтения: пути к копиям SQLite через запятую в
+# YATUBE_REPLICAS (обновляются командой sync_replicas)
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get(
+        'YATUBE_REPLICAS', '').split(','))):
+    alias = 'replica{}'.format(index)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+# сколько секунд после записи пользователь читает с основной базы
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -146,16 +172,104 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
+# письма уходят через очередь задач, а отправляет их QUEUED_EMAIL_BACKEND
+EMAIL_BACKEND = 'core.mail.QueuedEmailBackend'
 #  подключаем движок filebased.EmailBackend
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+QUEUED_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# рабочие файлы сайта (кэш, метрики); каталог создаётся с правами 0700
+VAR_DIR = os.environ.get('YATUBE_VAR_DIR', os.path.join(BASE_DIR, 'var'))
+
+# общий для всех процессов кэш в файле SQLite (core/cache_backend.py);
+# в нём сессии и пользователи, поэтому файлы доступны только владельцу
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache_backend.SQLiteCache',
+        'LOCATION': os.path.join(VAR_DIR, 'cache.sqlite3'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 2 ** 20,
+        },
+    },
+    # сессии отдельно: cache.clear() не должен разлогинивать всех
+    'sessions': {
+        'BACKEND': 'core.cache_backend.SQLiteCache',
+        'LOCATION': os.path.join(VAR_DIR, 'sessions.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+            'MAX_SIZE': 512 * 2 ** 20,
+        },
+    },
 }
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# сессии читаются из кэша, в базу идут только изменения
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# пользователь сессии тоже берётся из кэша (users/backends.py)
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = 60 * 60
+# страницы лент для анонимов сбрасываются по событиям, TTL -- страховка
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+# версии лент; не меньше FEED_CACHE_TIMEOUT, иначе страницы живут меньше
+FEED_VERSION_TIMEOUT = 60 * 60 * 24
+
+# очередь фоновых задач core.jobs и её воркеры (команда run_workers);
+# JOBS_EAGER выполняет задачи сразу при постановке
+JOBS_EAGER = False
+JOBS_PROCESSES = 2
+JOBS_THREADS = 2
+JOBS_POLL_INTERVAL = 1
+JOBS_LEASE_SECONDS = 60 * 5
+JOBS_MAX_ATTEMPTS = 5
+# задержка первого повтора, дальше она удваивается
+JOBS_RETRY_DELAY = 10
+# сколько дней хранить задачи, исчерпавшие попытки
+JOBS_FAILED_KEEP_DAYS = 30
+
+# сколько самых релевантных постов отдаёт полнотекстовый поиск
+SEARCH_MAX_RESULTS = 500
+
+# режим постраничного вывода лент: 'cursor' (по ключу) или 'pages' (?page=N)
+POSTS_PAGINATION = 'cursor'
+
+# постраничный вывод ?page=N: до порога строки считаются точно, больше --
+# COUNT берётся из кэша и пересчитывается раз в PAGINATION_COUNT_TIMEOUT
+PAGINATION_COUNT_THRESHOLD = 10000
+PAGINATION_COUNT_TIMEOUT = 60 * 10
+
+# лента подписок: максимальная длина и порог подписчиков, после которого
+# посты автора не раскладываются по лентам, а подмешиваются при чтении
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_FANOUT_LIMIT = 10000
+
+# посты старше этого числа дней команда archive_posts переносит в архивные
+# таблицы; профиль и страница поста читают обе таблицы
+POSTS_ARCHIVE_AFTER_DAYS = 365
+
+# удаление авторов, групп, старых комментариев и картинок (команда purge):
+# строк в одной транзакции и пауза между транзакциями, секунды
+PURGE_BATCH_SIZE = 200
+PURGE_PAUSE = 0.05
+
+# дайджест новых постов подписчикам (команда send_digest): интервал,
+# подписчиков в одной задаче, постов в письме и адрес сайта для ссылок
+DIGEST_INTERVAL_MINUTES = 60 * 24
+DIGEST_BATCH_SIZE = 500
+DIGEST_MAX_POSTS = 20
+DIGEST_SITE_URL = 'https://alexsev.pythonanywhere.com'
+
+# проверка бюджета SQL-запросов представлений: 'off', 'log' или 'strict'
+QUERY_BUDGET_MODE = 'log'
+
+# метрики /metrics: каталог для снимков процессов WSGI-сервера (None --
+# только текущий процесс) и как часто процесс обновляет свой снимок
+METRICS_DIR = os.path.join(VAR_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 5
 
 # Добавьте IP адреса, при обращении с которых будет доступен DjDT
 INTERNAL_IPS = [